@@ -1,6 +1,19 @@
-from webapp.webapp import app
+try:
+    from cheroot import wsgi
+    from cheroot.ssl.builtin import BuiltinSSLAdapter
+except ImportError:
+    wsgi = None
 
 if __name__ == '__main__':
+    # Imported here because the chart worker processes re-import this module on start, and must not start the bots
+    from webapp.webapp import app
+
     context = ('santihub.crt', 'santihub.key')
-    app.run(host='0.0.0.0', ssl_context=context, threaded=True)
 
+    if wsgi is not None:
+        # Fixed pool of connection threads instead of Flask's thread per request
+        server = wsgi.Server(('0.0.0.0', 5000), app, numthreads=16)
+        server.ssl_adapter = BuiltinSSLAdapter(*context)
+        server.start()
+    else:
+        app.run(host='0.0.0.0', ssl_context=context, threaded=True)
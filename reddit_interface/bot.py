@@ -2,17 +2,16 @@ import praw
 import OAuth2Util
 from praw.handlers import MultiprocessHandler
 from imgurpython import ImgurClient
-import matplotlib.pyplot as plt
-import math
-import numpy as np
-from time import sleep
-import os
+import collections
 import reddit_interface.utils as utils
 import reddit_interface.bot_threading as bot_threading
+import reddit_interface.charts as charts
+import reddit_interface.image_sinks as image_sinks
+import reddit_interface.summary_stats as summary_stats
 import traceback
 import puni
 import datetime
-import requests.exceptions
+import time
 
 SLACK_BOT_TOKEN = utils.get_token('SLACK_BOT_TOKEN')
 
@@ -20,12 +19,13 @@ SLACK_BOT_TOKEN = utils.get_token('SLACK_BOT_TOKEN')
 class RedditBot:
     """Class that implements a Reddit bot to perform moderator actions in a specific subreddit"""
 
-    def __init__(self, db, config, load_side_threads=True, debug=False):
+    def __init__(self, db, config, load_side_threads=True, debug=False, image_sink=None):
         handler = MultiprocessHandler()
         self.db = db
         self.config = config
         self.r = praw.Reddit(user_agent="windows:RedditSlacker 0.1 by /u/santi871", handler=handler)
         self.imgur = ImgurClient(utils.get_token('IMGUR_CLIENT_ID'), utils.get_token('IMGUR_CLIENT_SECRET'))
+        self.image_sink = image_sink or image_sinks.ImgurSink(self.imgur)
         self.debug = debug
 
         try:
@@ -42,52 +42,91 @@ class RedditBot:
                               'hugepilchard', 'curmudgy', 'h2g2_researcher', 'jim777ps3', 'letstrythisagain_',
                               'mr_magnus', 'terrorpaw', 'kodack10', 'doc_daneeka')
 
-        self.already_done = self.fetch_already_done("already_done.txt")
+        self.seen_items = utils.SeenItems(self.db)
+        self.seen_items.import_legacy_file("already_done.txt", ("comments", "modlog", "modmail", "submissions"))
+
+        self.modmails = collections.OrderedDict()
+        self.max_cached_modmails = 100
+        self.summaries = utils.SummaryCache(config.summary_cache_ttl)
+        self.unflaired_submissions = None
+
+        # Adaptive pollers by the prefix of their *_interval_min/max config parameters
+        self.pollers = dict()
 
         if load_side_threads:
+            scheduler = bot_threading.scheduler
 
+            # Each poller returns how many new items it found, and aims for about half a listing page per run
             if config.monitor_comments:
-                self.comments_feed()
+                self.pollers["comments"] = scheduler.add_task(
+                    self.subreddit_name + " comments_feed", self.comments_feed, 120,
+                    min_interval=config.comments_interval_min, max_interval=config.comments_interval_max, target=50)
             if config.monitor_modlog:
-                self.track_users()
+                self.pollers["modlog"] = scheduler.add_task(
+                    self.subreddit_name + " track_users", self.track_users, 300,
+                    min_interval=config.modlog_interval_min, max_interval=config.modlog_interval_max, target=15)
             if config.monitor_modmail:
-                self.monitor_modmail()
+                self.pollers["modmail"] = scheduler.add_task(
+                    self.subreddit_name + " monitor_modmail", self.monitor_modmail, 5,
+                    min_interval=config.modmail_interval_min, max_interval=config.modmail_interval_max, target=5)
             if config.remove_unflaired:
-                self.handle_unflaired()
+                self.pollers["submissions"] = scheduler.add_task(
+                    self.subreddit_name + " handle_unflaired", self.handle_unflaired, 120,
+                    min_interval=config.submissions_interval_min, max_interval=config.submissions_interval_max,
+                    target=10)
+                # Flair checks and expiry follow their own deadlines, independently of the new submissions poll
+                scheduler.add_task(self.subreddit_name + " check_unflaired", self.check_unflaired, 30)
+
+            scheduler.add_task(self.subreddit_name + " log_bans", self.log_bans, 600)
+            scheduler.add_task(self.subreddit_name + " decay_user_tracks", self.decay_user_tracks, 300)
+            scheduler.add_task(self.subreddit_name + " expire_rollups", self.db.expire_rollups, 600)
+            scheduler.add_task(self.subreddit_name + " prune_comment_history",
+                               lambda: self.db.prune_comment_history(30 * 86400), 86400)
+
+            # Registered after the RSConfig's own listener, so it sees the new values
+            config.registry.add_listener(self.update_poller_intervals)
+
+    def update_poller_intervals(self):
+
+        """Applies the configured interval bounds to the running pollers, so /rsconfig changes take effect without
+        a restart"""
 
-            self.log_bans()
+        for prefix, task in self.pollers.items():
+            task.set_bounds(getattr(self.config, prefix + "_interval_min"),
+                            getattr(self.config, prefix + "_interval_max"))
 
     def _authenticate(self):
         o = OAuth2Util.OAuth2Util(self.r)
         o.refresh(force=True)
         self.r.config.api_request_delay = 1
 
-    @staticmethod
-    def fetch_already_done(filename):
+    def listing_since_cursor(self, stream, listing, page_size, catch_up_limit=1000):
 
-        already_done = []
-        try:
-            with open(filename, "r") as text_file:
-                already_done = text_file.read().split(",")
+        """Yields the items of a newest-first listing that arrived since the last run of the stream, oldest first.
+        The newest processed ID is stored in the database, and praw keeps paging back through the listing until it
+        finds it again, so a busy period or a restart doesn't leave holes. The cursor only moves once every item has
+        been yielded"""
 
-                if int(os.stat('already_done.txt').st_size) >= 409600:
-                    already_done = already_done[int(len(already_done) * 0.75):]
-                try:
-                    already_done.remove('')
-                except ValueError:
-                    pass
+        key = "cursor:" + stream
+        cursor = self.db.get_state(key)
 
-        except FileNotFoundError:
-            with open(filename, "a+"):
-                pass
+        self.r._use_oauth = False
+        if cursor is None:
+            items = list(listing(limit=page_size))
+        else:
+            items = list(listing(limit=catch_up_limit, place_holder=cursor))
 
-        with open(filename, 'w+') as text_file:
-            text_file.write(','.join(already_done))
+            if items and items[-1].id == cursor:
+                items.pop()
+            else:
+                print("Lost track of the %s listing of /r/%s: %s not found in the newest %s items." %
+                      (stream, self.subreddit_name, cursor, catch_up_limit))
 
-        with open(filename, "r") as text_file:
-            already_done = text_file.read().split(",")
+        for item in reversed(items):
+            yield item
 
-        return already_done
+        if items:
+            self.db.set_state(key, items[0].id)
 
     def get_last_note(self, username):
         notes = list(self.un.get_notes(username))
@@ -97,11 +136,15 @@ class RedditBot:
         else:
             return str(notes[0].note)
 
-    def add_note(self, username, author, note_type):
+    @bot_threading.own_thread
+    def add_note(self, kwargs):
+
+        username = kwargs['username']
+        n = puni.Note(username, kwargs['note'], username, '', kwargs['note_type'])
 
-        n = puni.Note(username, "Permamuted via RedditSlacker by Slack user '%s'" % author,
-                      username, '', note_type)
+        self.r._use_oauth = False
         self.un.add_note(n)
+        self.summaries.invalidate(username)
 
     def get_user_name(self, username):
         redditor = self.r.get_redditor(username)
@@ -134,99 +177,119 @@ class RedditBot:
                                               value=comment.author.name)
             response.attachments[0].add_button("Verify", value="verify", style='primary')
             response.attachments[0].add_button("Track user", value="track_" + comment.author.name)
-            response.post_to_channel(token=self.config.bot_user_token, channel='#ban-requests')
+            response.post_to_channel(token=self.config.bot_user_token, channel=self.config.ban_requests_channel)
 
             comment.report("Slack user @%s has requested a ban." % author)
             response = utils.SlackResponse(text="Ban requested.")
             request.delayed_response(response)
 
-    @bot_threading.own_thread
-    def log_bans(self):
+    def log_bans(self, full_sync_interval=86400):
 
-        if not self.config.banlist_populated:
-            limit = None
-        else:
-            limit = 20
+        """Stores the bans issued since the newest one already stored. The ban list is newest first and praw fetches
+        it a page at a time, so this usually costs a single request. Every full_sync_interval seconds the whole list is
+        read instead, to fill any gaps and to record which users have been unbanned"""
 
-        while True:
-            self.r._use_oauth = False
-            bans = self.r.get_subreddit(self.subreddit_name).get_banned(limit=limit, user_only=False, fetch=True)
+        last_full_sync = self.db.get_state("bans:last_full_sync")
+        full_sync = last_full_sync is None or time.time() - float(last_full_sync) >= full_sync_interval
+        newest = float(self.db.get_state("bans:newest", 0))
 
-            self.r._use_oauth = False
-            for ban in bans:
-                    self.db.log_ban(ban)
+        self.r._use_oauth = False
+        bans = self.r.get_subreddit(self.subreddit_name).get_banned(limit=None, user_only=False, fetch=True)
 
-            sleep(600)
+        new_bans = []
 
-    @bot_threading.own_thread
-    def comments_feed(self):
+        for ban in bans:
+            # Bans from the same second as the newest stored one are fetched again and ignored by the database
+            if not full_sync and ban['date'] < newest:
+                break
 
-        while True:
+            new_bans.append(ban)
 
-            tracked_users = [track[1].lower() for track in self.db.fetch_tracks("tracked")]
+        self.db.log_bans(new_bans)
 
-            self.r._use_oauth = False
-            comments = self.r.get_subreddit(self.subreddit_name).get_comments(limit=100, sort='new')
+        if full_sync:
+            unbans = self.db.record_unbans([ban['id'] for ban in new_bans])
+            self.db.set_state("bans:last_full_sync", time.time())
+            print("Synced the ban list of /r/%s: %s bans, %s lifted since the last sync." %
+                  (self.subreddit_name, len(new_bans), unbans))
 
-            for comment in comments:
+        if new_bans:
+            self.db.set_state("bans:newest", max(newest, max(ban['date'] for ban in new_bans)))
 
-                if comment.id not in self.already_done:
-                    self.r._use_oauth = False
+        return len(new_bans)
 
-                    try:
-                        submission = comment.submission
-                    except AttributeError:
-                        submission = None
+    def comments_feed(self):
 
-                    if comment.is_root and comment.author.name != "ELI5_BotMod"\
-                            and comment.author.name != 'AutoModerator' and comment.banned_by is None:
+        tracked_users = [track[1].lower() for track in self.db.fetch_tracks("tracked")]
 
-                        response = utils.SlackResponse()
+        subreddit = self.r.get_subreddit(self.subreddit_name)
+        comments = self.listing_since_cursor("comments", lambda **kwargs: subreddit.get_comments(sort='new', **kwargs),
+                                             100)
+
+        new_comments = 0
 
-                        self.r._use_oauth = False
-                        response.add_attachment(text=comment.body,
-                                                color="#0073a3", title=submission.title,
-                                                title_link=comment.permalink, callback_id="tlcfeed")
-                        response.attachments[0].add_field("Author", comment.author.name)
-                        response.attachments[0].add_button("Approve", "approve_" + comment.id, style="primary")
-                        response.attachments[0].add_button("Remove", "remove_" + comment.id, style="danger")
-                        # response.attachments[0].add_button("Summary", "summary_" + comment.author.name)
-                        response.attachments[0].add_button("Request ban", "banreq_" + comment.id)
+        for comment in comments:
 
-                        slack_response = response.post_to_channel(token=self.config.bot_user_token,
-                                                                  channel='#tlc-feed')
+            if not self.seen_items.contains("comments", comment.id):
+                new_comments += 1
+                self.r._use_oauth = False
 
-                    if comment.author.name.lower() in tracked_users:
-                        response = utils.SlackResponse(text="New comment by user /u/" + comment.author.name)
+                try:
+                    submission = comment.submission
+                except AttributeError:
+                    submission = None
 
-                        self.r._use_oauth = False
-                        response.add_attachment(title=submission.title, title_link=comment.permalink,
-                                                text=comment.body, color="#warning")
+                if comment.is_root and comment.author.name != "ELI5_BotMod"\
+                        and comment.author.name != 'AutoModerator' and comment.banned_by is None:
 
-                        response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
+                    response = utils.SlackResponse()
 
                     self.r._use_oauth = False
+                    response.add_attachment(text=comment.body,
+                                            color="#0073a3", title=submission.title,
+                                            title_link=comment.permalink, callback_id="tlcfeed")
+                    response.attachments[0].add_field("Author", comment.author.name)
+                    response.attachments[0].add_button("Approve", "approve_" + comment.id, style="primary")
+                    response.attachments[0].add_button("Remove", "remove_" + comment.id, style="danger")
+                    # response.attachments[0].add_button("Summary", "summary_" + comment.author.name)
+                    response.attachments[0].add_button("Request ban", "banreq_" + comment.id)
 
-                    try:
-                        if comment.author.name.lower() == submission.author.name.lower()\
-                                and len(comment.body) > 500:
+                    response.post_to_channel(token=self.config.bot_user_token,
+                                             channel=self.config.tlc_feed_channel, wait=False)
 
-                            warning_trigger = self.db.add_submission_op_reply(submission.id)
+                if comment.author.name.lower() in tracked_users:
+                    response = utils.SlackResponse(text="New comment by user /u/" + comment.author.name)
 
-                            if warning_trigger:
-                                response = utils.SlackResponse(text="Detected possible soapboxing attempt.")
-                                response.add_attachment(title=submission.title,
-                                                        title_link=submission.permalink, color='warning')
-                                response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-                                submission.report("Possible soapbox attempt.")
-                    except AttributeError:
-                        pass
+                    self.r._use_oauth = False
+                    response.add_attachment(title=submission.title, title_link=comment.permalink,
+                                            text=comment.body, color="#warning")
 
-                    self.already_done.append(comment.id)
+                    response.post_to_channel(token=self.config.bot_user_token,
+                                             channel=self.config.rs_feed_channel, wait=False)
 
-                    with open("already_done.txt", "a") as text_file:
-                        print(comment.id + ",", end="", file=text_file)
-            sleep(120)
+                self.r._use_oauth = False
+
+                try:
+                    if comment.author.name.lower() == submission.author.name.lower()\
+                            and len(comment.body) > 500:
+
+                        warning_trigger = self.db.add_submission_op_reply(submission.id)
+
+                        if warning_trigger:
+                            response = utils.SlackResponse(text="Detected possible soapboxing attempt.")
+                            response.add_attachment(title=submission.title,
+                                                    title_link=submission.permalink, color='warning')
+                            response.post_to_channel(token=self.config.bot_user_token,
+                                                     channel=self.config.rs_feed_channel, wait=False)
+                            submission.report("Possible soapbox attempt.")
+                except AttributeError:
+                    pass
+
+                self.seen_items.add("comments", comment.id)
+
+        self.seen_items.flush()
+
+        return new_comments
 
     @bot_threading.own_thread
     def remove_comment(self, kwargs):
@@ -253,204 +316,276 @@ class RedditBot:
     @bot_threading.own_thread
     def reset_user_tracks(self):
         self.db.reset_user_tracks()
+        self.summaries.clear()
+
+    def update_user_status(self, username, status):
+
+        """Sets a user's track status and drops their cached summary, which shows it"""
+
+        self.db.update_user_status(username, status)
+        self.summaries.invalidate(username)
+
+    def decay_user_tracks(self, batch_size=500, max_batches=10):
+
+        """Every track_decay_days days, halves every user's removal and ban counters so that old activity stops
+        counting towards the warning thresholds. Goes through the users a few batches per run, remembering where it
+        stopped, so the database is never held for long"""
+
+        decay_days = self.config.track_decay_days
+
+        if decay_days <= 0:
+            return
+
+        cursor = self.db.get_state("track_decay_cursor")
+        started = self.db.get_state("track_decay_started")
+
+        if started is None:
+            # Decay was just turned on, the first pass happens decay_days from now
+            self.db.set_state("track_decay_started", time.time())
+            return
+
+        if cursor is None:
+            if time.time() - float(started) < decay_days * 86400:
+                return
+
+            self.db.set_state("track_decay_started", time.time())
+            cursor = 0
+
+        for batch in range(max_batches):
+            last_id = self.db.decay_user_tracks(int(cursor), batch_size)
+
+            if last_id is None:
+                self.db.set_state("track_decay_cursor", None)
+                return
+
+            self.summaries.clear()
+            cursor = last_id
+            self.db.set_state("track_decay_cursor", cursor)
 
-    @bot_threading.own_thread
     def track_users(self):
         subreddit = self.r.get_subreddit(self.subreddit_name)
         ignored_users = ['ELI5_BotMod', 'AutoModerator']
 
-        while True:
-            self.r._use_oauth = False
-            modlog = subreddit.get_mod_log(limit=30)
-            already_done_user = []
-
-            for item in modlog:
-                if item.id not in self.already_done and item.target_fullname not in self.already_done and \
-                        item.target_author not in ignored_users:
-                    user_dict = self.db.handle_mod_log(item)
-
-                    if item.target_author not in already_done_user and user_dict is not None:
+        modlog = self.listing_since_cursor("modlog", subreddit.get_mod_log, 30)
+        already_done_user = []
+        new_items = 0
 
-                        done = False
-
-                        comment_warning_threshold = self.config.comment_warning_threshold
-
-                        comment_warning_threshold_high = self.config.comment_warning_threshold_high
-
-                        submission_warning_threshold = self.config.submission_warning_threshold
-
-                        submission_warning_threshold_high = self.config.submission_warning_threshold_high
-
-                        ban_warning_threshold = self.config.ban_warning_threshold
-
-                        ban_warning_threshold_high = self.config.ban_warning_threshold_high
-
-                        if user_dict['comment_removals'] >= comment_warning_threshold:
-                            response = utils.SlackResponse()
-                            response.add_attachment(title="Warning regarding user /u/" + user_dict['username'],
-                                                    title_link="https://www.reddit.com/user/" + user_dict['username'],
-                                                    text="User has had %s> comments removed. "
-                                                         "Please check profile history." %
-                                                    str(comment_warning_threshold),
-                                                    color='warning', callback_id="userwarning")
-                            response.attachments[0].add_button("Verify", value="verify", style='primary')
-                            response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
-                            response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
-                                                               style='danger')
-
-                            response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-
-                            done = True
-
-                        if user_dict['comment_removals'] >= comment_warning_threshold_high:
-                            response = utils.SlackResponse()
-                            response.add_attachment(title="*Urgent warning* regarding user /u/" + user_dict['username'],
-                                                    title_link="https://www.reddit.com/user/" + user_dict['username'],
-                                                    text="User has had %s> comments removed. "
-                                                         "Please check profile history immediately." %
-                                                    str(comment_warning_threshold_high),
-                                                    color='danger', callback_id="userwarning")
-                            response.attachments[0].add_button("Verify", value="verify", style='primary')
-                            response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
-                            response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
-                                                               style='danger')
-
-                            response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-
-                            done = True
-
-                        if user_dict['link_removals'] >= submission_warning_threshold:
-                            response = utils.SlackResponse()
-                            response.add_attachment(title="Warning regarding user /u/" + user_dict['username'],
-                                                    title_link="https://www.reddit.com/user/" + user_dict['username'],
-                                                    text="User has had %s> submissions removed. Please check profile"
-                                                         " history." % str(submission_warning_threshold),
-                                                    color='warning', callback_id="userwarning")
-                            response.attachments[0].add_button("Verify", value="verify", style="primary")
-                            response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
-                            response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
-                                                               style='danger')
-
-                            response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-
-                            done = True
-
-                        if user_dict['link_removals'] >= submission_warning_threshold_high:
-                            response = utils.SlackResponse()
-                            response.add_attachment(title="*Urgent warning* regarding user /u/" + user_dict['username'],
-                                                    title_link="https://www.reddit.com/user/" + user_dict['username'],
-                                                    text="User has had %s> submissions removed. Please check profile"
-                                                         " history immediately." %
-                                                         str(submission_warning_threshold_high),
-                                                    color='danger', callback_id="userwarning")
-                            response.attachments[0].add_button("Verify", value="verify", style="primary")
-                            response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
-                            response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
-                                                               style='danger')
-
-                            response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-
-                            done = True
-
-                        if user_dict['bans'] >= ban_warning_threshold:
-
-                            response = utils.SlackResponse()
-                            response.add_attachment(title="Warning regarding user /u/" + user_dict['username'],
-                                                    title_link="https://www.reddit.com/user/" + user_dict['username'],
-                                                    text="User has been banned %s> times. Please check profile history."
-                                                    % str(ban_warning_threshold),
-                                                    color='warning', callback_id="userwarning")
-                            response.attachments[0].add_button("Verify", value="verify", style='primary')
-                            response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
-                            response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
-                                                               style='danger')
-
-                            response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-
-                            done = True
+        for item in modlog:
+            if not self.seen_items.contains("modlog", item.id) and \
+                    not self.seen_items.contains("modlog", item.target_fullname) and \
+                    item.target_author not in ignored_users:
+                new_items += 1
+                user_dict = self.db.handle_mod_log(item, window_days=self.config.warning_window_days)
 
-                        if user_dict['bans'] >= ban_warning_threshold_high:
-
-                            response = utils.SlackResponse()
-                            response.add_attachment(title="*Urgent warning* regarding user /u/" + user_dict['username'],
-                                                    title_link="https://www.reddit.com/user/" + user_dict['username'],
-                                                    text="User has been banned %s> times. "
-                                                         "Please check profile history immediately."
-                                                         % str(ban_warning_threshold_high),
-                                                    color='danger', callback_id="userwarning")
-                            response.attachments[0].add_button("Verify", value="verify", style='primary')
-                            response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
-                            response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
-                                                               style='danger')
-
-                            response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-
-                            done = True
-
-                        if done:
-                            already_done_user.append(user_dict['username'])
-
-                    self.already_done.append(item.id)
-                    self.already_done.append(item.target_fullname)
-
-                    with open("already_done.txt", "a") as text_file:
-                        print(item.id + ",", end="", file=text_file)
-
-                        try:
-                            print(item.target_fullname + ',', end="", file=text_file)
-                        except TypeError:
-                            pass
-            sleep(300)
+                if user_dict is not None:
+                    self.summaries.invalidate(item.target_author)
+
+                if item.target_author not in already_done_user and user_dict is not None:
+
+                    done = False
+
+                    comment_warning_threshold = self.config.comment_warning_threshold
+
+                    comment_warning_threshold_high = self.config.comment_warning_threshold_high
+
+                    submission_warning_threshold = self.config.submission_warning_threshold
+
+                    submission_warning_threshold_high = self.config.submission_warning_threshold_high
+
+                    ban_warning_threshold = self.config.ban_warning_threshold
+
+                    ban_warning_threshold_high = self.config.ban_warning_threshold_high
+
+                    if user_dict['comment_removals'] >= comment_warning_threshold:
+                        response = utils.SlackResponse()
+                        response.add_attachment(title="Warning regarding user /u/" + user_dict['username'],
+                                                title_link="https://www.reddit.com/user/" + user_dict['username'],
+                                                text="User has had %s> comments removed. "
+                                                     "Please check profile history." %
+                                                str(comment_warning_threshold),
+                                                color='warning', callback_id="userwarning")
+                        response.attachments[0].add_button("Verify", value="verify", style='primary')
+                        response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
+                        response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
+                                                           style='danger')
+
+                        response.post_to_channel(token=self.config.bot_user_token,
+                                                 channel=self.config.rs_feed_channel, wait=False)
+
+                        done = True
+
+                    if user_dict['comment_removals'] >= comment_warning_threshold_high:
+                        response = utils.SlackResponse()
+                        response.add_attachment(title="*Urgent warning* regarding user /u/" + user_dict['username'],
+                                                title_link="https://www.reddit.com/user/" + user_dict['username'],
+                                                text="User has had %s> comments removed. "
+                                                     "Please check profile history immediately." %
+                                                str(comment_warning_threshold_high),
+                                                color='danger', callback_id="userwarning")
+                        response.attachments[0].add_button("Verify", value="verify", style='primary')
+                        response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
+                        response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
+                                                           style='danger')
+
+                        response.post_to_channel(token=self.config.bot_user_token,
+                                                 channel=self.config.rs_feed_channel, wait=False)
+
+                        done = True
+
+                    if user_dict['link_removals'] >= submission_warning_threshold:
+                        response = utils.SlackResponse()
+                        response.add_attachment(title="Warning regarding user /u/" + user_dict['username'],
+                                                title_link="https://www.reddit.com/user/" + user_dict['username'],
+                                                text="User has had %s> submissions removed. Please check profile"
+                                                     " history." % str(submission_warning_threshold),
+                                                color='warning', callback_id="userwarning")
+                        response.attachments[0].add_button("Verify", value="verify", style="primary")
+                        response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
+                        response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
+                                                           style='danger')
+
+                        response.post_to_channel(token=self.config.bot_user_token,
+                                                 channel=self.config.rs_feed_channel, wait=False)
+
+                        done = True
+
+                    if user_dict['link_removals'] >= submission_warning_threshold_high:
+                        response = utils.SlackResponse()
+                        response.add_attachment(title="*Urgent warning* regarding user /u/" + user_dict['username'],
+                                                title_link="https://www.reddit.com/user/" + user_dict['username'],
+                                                text="User has had %s> submissions removed. Please check profile"
+                                                     " history immediately." %
+                                                     str(submission_warning_threshold_high),
+                                                color='danger', callback_id="userwarning")
+                        response.attachments[0].add_button("Verify", value="verify", style="primary")
+                        response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
+                        response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
+                                                           style='danger')
+
+                        response.post_to_channel(token=self.config.bot_user_token,
+                                                 channel=self.config.rs_feed_channel, wait=False)
+
+                        done = True
+
+                    if user_dict['bans'] >= ban_warning_threshold:
+
+                        response = utils.SlackResponse()
+                        response.add_attachment(title="Warning regarding user /u/" + user_dict['username'],
+                                                title_link="https://www.reddit.com/user/" + user_dict['username'],
+                                                text="User has been banned %s> times. Please check profile history."
+                                                % str(ban_warning_threshold),
+                                                color='warning', callback_id="userwarning")
+                        response.attachments[0].add_button("Verify", value="verify", style='primary')
+                        response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
+                        response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
+                                                           style='danger')
+
+                        response.post_to_channel(token=self.config.bot_user_token,
+                                                 channel=self.config.rs_feed_channel, wait=False)
+
+                        done = True
+
+                    if user_dict['bans'] >= ban_warning_threshold_high:
+
+                        response = utils.SlackResponse()
+                        response.add_attachment(title="*Urgent warning* regarding user /u/" + user_dict['username'],
+                                                title_link="https://www.reddit.com/user/" + user_dict['username'],
+                                                text="User has been banned %s> times. "
+                                                     "Please check profile history immediately."
+                                                     % str(ban_warning_threshold_high),
+                                                color='danger', callback_id="userwarning")
+                        response.attachments[0].add_button("Verify", value="verify", style='primary')
+                        response.attachments[0].add_button("Track", value="track_" + user_dict['username'])
+                        response.attachments[0].add_button("Shadowban", value="shadowban_" + user_dict['username'],
+                                                           style='danger')
+
+                        response.post_to_channel(token=self.config.bot_user_token,
+                                                 channel=self.config.rs_feed_channel, wait=False)
+
+                        done = True
+
+                    if done:
+                        already_done_user.append(user_dict['username'])
+
+                self.seen_items.add("modlog", item.id, item.target_fullname)
+
+        self.seen_items.flush()
+
+        return new_items
+
+    def get_modmail_thread(self, message):
+
+        """Returns the SlackModmail mirroring a modmail thread. Threads that have dropped out of the in-memory cache
+        (or were posted before a restart) are resumed from the database, and threads with no saved state start a new
+        Slack message"""
+
+        modmail = self.modmails.pop(message.id, None)
+
+        if modmail is None:
+            state = self.db.get_modmail_thread(message.id)
+
+            if state is not None:
+                modmail = utils.SlackModmail.resume(message, self.config.bot_user_token, state, db=self.db)
+            else:
+                modmail = utils.SlackModmail(message, self.config.bot_user_token, self.config.modmail_channel,
+                                             db=self.db)
+
+        self.modmails[message.id] = modmail
+
+        while len(self.modmails) > self.max_cached_modmails:
+            evicted_id, evicted = self.modmails.popitem(last=False)
+            evicted.post()
+
+        return modmail
 
-    @bot_threading.own_thread
     def monitor_modmail(self):
 
-        modmails = dict()
+        new_messages = 0
+
+        try:
+            self.r._use_oauth = False
+            modmail = self.r.get_mod_mail(self.subreddit_name, limit=10)
 
-        while True:
+            muted_users = [track[1] for track in self.db.fetch_tracks("permamuted")]
 
-            try:
-                self.r._use_oauth = False
-                modmail = self.r.get_mod_mail(self.subreddit_name, limit=10)
+            self.r._use_oauth = False
+            for message in modmail:
+                if not self.seen_items.contains("modmail", message.id):
+                    new_messages += 1
 
-                muted_users = [track[1] for track in self.db.fetch_tracks("permamuted")]
+                    if message.author.name in muted_users:
 
-                self.r._use_oauth = False
-                for message in modmail:
-                    if message.id not in self.already_done:
+                        if not self.debug:
+                            message.mute_modmail_author()
 
-                        if message.author.name in muted_users:
+                    slack_modmail = self.get_modmail_thread(message)
 
-                            if not self.debug:
-                                message.mute_modmail_author()
+                    for reply in list(message.replies)[slack_modmail.n_replies:]:
+                        slack_modmail.add_reply(reply)
+                        self.seen_items.add("modmail", reply.id)
 
-                        modmails[message.id] = utils.SlackModmail(message, self.config.bot_user_token, "C208X7WR0")
+                    slack_modmail.post()
+                    self.seen_items.add("modmail", message.id)
+                    self.db.prune_modmail_threads(90 * 86400)
 
-                        for reply in message.replies:
-                            modmails[message.id].add_reply(reply)
-                            with open("already_done.txt", "a") as text_file:
-                                print(reply.id + ",", end="", file=text_file)
-                            self.already_done.append(reply.id)
+                else:
+                    slack_modmail = None
 
-                        self.already_done.append(message.id)
+                    for reply in message.replies:
+                        if not self.seen_items.contains("modmail", reply.id):
+                            new_messages += 1
 
-                        with open("already_done.txt", "a") as text_file:
-                            print(message.id + ",", end="", file=text_file)
+                            if slack_modmail is None:
+                                slack_modmail = self.get_modmail_thread(message)
 
-                    else:
-                        for reply in message.replies:
-                            if reply.id not in self.already_done:
-                                try:
-                                    modmails[message.id].add_reply(reply)
-                                    with open("already_done.txt", "a") as text_file:
-                                        print(reply.id + ",", end="", file=text_file)
-                                    self.already_done.append(reply.id)
-                                except KeyError:
-                                    break
-            except AttributeError:
-                pass
+                            slack_modmail.add_reply(reply)
+                            self.seen_items.add("modmail", reply.id)
+        except AttributeError:
+            pass
 
-            sleep(5)
+        self.seen_items.flush()
+
+        return new_messages
 
     @staticmethod
     def remove_from_file(filename, str_to_remove):
@@ -466,88 +601,183 @@ class RedditBot:
         with open(filename, "w") as text_file:
             text_file.write(','.join(file_data))
 
-    @bot_threading.own_thread
     def handle_unflaired(self):
-        print("Starting handle_unflaired thread...")
 
         r = self.r
-        unflaired_submissions = self.db.fetch_unflaired_submissions(r)
+
+        if self.unflaired_submissions is None:
+            # The queue is only set up once the stored submissions are loaded, so a failed load is retried next run
+            stored = self.db.fetch_unflaired_submissions(r)
+            self.unflaired_submissions = utils.UnflairedQueue()
+
+            for unflaired_submission in stored:
+                self.add_unflaired(unflaired_submission)
+
         tracked_users = [track[1].lower() for track in self.db.fetch_tracks("tracked")]
+        highest_timestamp = datetime.datetime.now() - datetime.timedelta(minutes=10)
+        new_submissions = 0
 
-        while True:
+        submissions = self.listing_since_cursor("submissions", r.get_subreddit(self.subreddit_name).get_new, 20)
+
+        for submission in submissions:
+            new_submissions += 1
+
+            if submission.author.name.lower() in tracked_users and \
+                    not self.seen_items.contains("submissions", submission.id):
+                response = utils.SlackResponse(text="New submission by user /u/" + submission.author.name)
 
-            highest_timestamp = datetime.datetime.now() - datetime.timedelta(minutes=10)
-            try:
                 self.r._use_oauth = False
-                submissions = r.get_subreddit(self.subreddit_name).get_new(limit=20)
+                response.add_attachment(title=submission.title, title_link=submission.permalink,
+                                        text=submission.body, color="#warning")
+
+                response.post_to_channel(token=self.config.bot_user_token,
+                                         channel=self.config.rs_feed_channel, wait=False)
+                self.seen_items.add("submissions", submission.id)
+
+            if submission.created > highest_timestamp.timestamp() and \
+                            submission.link_flair_text is None:
+                submission.remove()
+
+                s1 = submission.author
+                s2 = 'https://www.reddit.com/message/compose/?to=/r/' + self.subreddit_name
+                s3 = submission.permalink
 
-                for submission in submissions:
+                comment = utils.generate_flair_comment(s1, s2, s3)
 
-                    if submission.author.name.lower() in tracked_users and submission.id not in self.already_done:
-                        response = utils.SlackResponse(text="New submission by user /u/" + submission.author.name)
+                comment_obj = submission.add_comment(comment)
+                comment_obj.distinguish(sticky=True)
 
-                        self.r._use_oauth = False
-                        response.add_attachment(title=submission.title, title_link=submission.permalink,
-                                                text=submission.body, color="#warning")
+                unflaired_submission = utils.UnflairedSubmission(submission, comment_obj)
 
-                        response.post_to_channel(token=self.config.bot_user_token, channel='#rs_feed')
-                        self.already_done.append(submission.id)
+                self.add_unflaired(unflaired_submission)
 
-                        with open("already_done.txt", "a") as text_file:
-                            print(submission.id + ",", end="", file=text_file)
+                self.db.log_unflaired_submission(submission.id, comment_obj.id)
 
-                    if submission.created > highest_timestamp.timestamp() and \
-                                    submission.link_flair_text is None:
-                        submission.remove()
+        self.seen_items.flush()
 
-                        s1 = submission.author
-                        s2 = 'https://www.reddit.com/message/compose/?to=/r/' + self.subreddit_name
-                        s3 = submission.permalink
+        return new_submissions
 
-                        comment = utils.generate_flair_comment(s1, s2, s3)
+    def add_unflaired(self, unflaired_submission):
 
-                        comment_obj = submission.add_comment(comment)
-                        comment_obj.distinguish(sticky=True)
+        """Starts checking a removed submission for a flair, and schedules its expiry for when it is 13600 seconds
+        old"""
 
-                        unflaired_submission = utils.UnflairedSubmission(submission, comment_obj)
+        self.unflaired_submissions.add(unflaired_submission)
 
-                        unflaired_submissions.append(unflaired_submission)
+        fullname = unflaired_submission.submission.fullname
+        expires_in = unflaired_submission.submission.created_utc + 13600 - time.time()
+        bot_threading.scheduler.call_later(max(expires_in, 0), lambda: self.expire_unflaired(fullname),
+                                           self.subreddit_name + " expire_unflaired")
 
-                        self.db.log_unflaired_submission(submission.id, comment_obj.id)
+    def expire_unflaired(self, fullname):
 
-                for unflaired_submission_obj in unflaired_submissions:
+        unflaired_submission_obj = self.unflaired_submissions.get(fullname)
 
-                    submission = unflaired_submission_obj.submission
-                    r._use_oauth = False
-                    submission = r.get_submission(submission_id=submission.id)
-                    comment = unflaired_submission_obj.comment
+        if unflaired_submission_obj is None:
+            return
 
-                    if submission.link_flair_text is not None:
-                        submission.approve()
+        try:
+            unflaired_submission_obj.comment.delete()
+        except:
+            # Expiry is a one-shot task, so the scheduler won't run it again by itself
+            bot_threading.scheduler.call_later(60, lambda: self.expire_unflaired(fullname),
+                                               self.subreddit_name + " expire_unflaired")
+            raise
+
+        if self.unflaired_submissions.remove(fullname) is not None:
+            self.db.delete_unflaired_submissions_row(unflaired_submission_obj.submission.id)
+
+    def check_unflaired(self):
+
+        """Re-approves the pending submissions that have been flaired since they were last checked. Only the
+        submissions that are due are fetched, all of them in one batch"""
+
+        if self.unflaired_submissions is None:
+            return 0
+
+        due = self.unflaired_submissions.pop_due()
+
+        if not due:
+            return 0
+
+        handled = 0
+
+        try:
+            submissions = utils.get_things(self.r, [obj.submission.fullname for obj in due])
+
+            for unflaired_submission_obj in due:
+
+                fullname = unflaired_submission_obj.submission.fullname
+                submission = submissions.get(fullname)
 
-                        for report in submission.mod_reports:
-                            submission.report(report[0])
-                            print(str(report))
+                if submission is not None and submission.link_flair_text is None:
+                    unflaired_submission_obj.submission = submission
+                    self.unflaired_submissions.reschedule(unflaired_submission_obj)
+                    handled += 1
+                    continue
+
+                # Flaired or gone from Reddit, unless it expired while we were fetching it
+                if self.unflaired_submissions.get(fullname) is not unflaired_submission_obj:
+                    handled += 1
+                    continue
+
+                if submission is not None:
+                    submission.approve()
+
+                    for report in submission.mod_reports:
+                        submission.report(report[0])
+                        print(str(report))
+
+                    unflaired_submission_obj.comment.delete()
+
+                # Only stop tracking it once Reddit is up to date, so a failed call above is retried next check
+                if self.unflaired_submissions.remove(fullname) is not None:
+                    self.db.delete_unflaired_submissions_row(unflaired_submission_obj.submission.id)
+                handled += 1
+        except:
+            # pop_due() took these off the heap, put the ones we didn't finish back on it so they're checked again
+            for unflaired_submission_obj in due[handled:]:
+                self.unflaired_submissions.reschedule(unflaired_submission_obj)
+            raise
+
+        return len(due)
+
+    def get_comment_history(self, user, limit=500, max_age=7 * 86400):
+
+        """Returns (created_utc, score, subreddit, words, short) for the user's newest limit comments, newest first.
+        Only the comments posted since the last call are fetched from Reddit, usually a single listing request. Every
+        max_age seconds the whole history is fetched again, so that scores and deletions don't go stale"""
+
+        state = self.db.get_comment_history_user(user.name)
+
+        self.r._use_oauth = False
+        if state is None or state[0] is None or time.time() - state[1] >= max_age:
+            comments = list(user.get_comments(limit=limit))
+            replace = True
+            full_fetch = int(time.time())
+        else:
+            newest_id, full_fetch = state
+            comments = list(user.get_comments(limit=limit, place_holder=newest_id))
 
-                        comment.delete()
-                        unflaired_submissions.remove(unflaired_submission_obj)
-                        self.db.delete_unflaired_submissions_row(submission.id)
-                    else:
+            if comments and comments[-1].id == newest_id:
+                comments.pop()
+                replace = False
+            else:
+                # The cached comments are too old (or were deleted), what we just fetched is the whole history now
+                replace = True
+                full_fetch = int(time.time())
 
-                        submission_time = datetime.datetime.fromtimestamp(submission.created)
-                        d = datetime.datetime.now() - submission_time
-                        delta_time = d.total_seconds()
+        rows = [(comment.id, int(comment.created_utc), comment.score, comment.subreddit.display_name,
+                 len(comment.body.split()), len(comment.body) < 200) for comment in comments]
 
-                        if delta_time >= 13600:
-                            unflaired_submissions.remove(unflaired_submission_obj)
-                            comment.delete()
-                            self.db.delete_unflaired_submissions_row(submission.id)
+        if comments:
+            newest_id = comments[0].id
+        elif replace:
+            newest_id = None
 
-            except (requests.exceptions.HTTPError, praw.errors.HTTPException):
-                sleep(2)
-                continue
+        self.db.save_comment_history(user.name, rows, newest_id, full_fetch, replace=replace, keep=limit)
 
-            sleep(120)
+        return self.db.fetch_comment_history(user.name, limit)
 
     def get_user_details(self, username):
         redditor = self.r.get_redditor(username)
@@ -568,6 +798,19 @@ class RedditBot:
         else:
             no_summary = False
 
+        self.summaries.ttl = self.config.summary_cache_ttl
+        cached = self.summaries.get(username, quick=no_summary)
+
+        if cached is not None:
+            response = utils.SlackResponse(replace_original=replace_original)
+            response.attachments = cached
+
+            if request is not None:
+                request.delayed_response(response)
+            return
+
+        started = time.time()
+
         try:
             user = self.r.get_redditor(username, fetch=True)
         except praw.errors.NotFound:
@@ -601,6 +844,11 @@ class RedditBot:
         response.attachments[0].add_field("Removed comments", comment_removals)
         response.attachments[0].add_field("Removed submissions", link_removals)
         response.attachments[0].add_field("Bans", bans)
+
+        for window, counters in sorted(self.db.fetch_user_rollups(username).items()):
+            response.attachments[0].add_field("Last %s days" % window,
+                                              "%s comments, %s submissions removed, %s bans" % counters)
+
         response.attachments[0].add_field("Shadowbanned", user_is_shadowbanned)
         response.attachments[0].add_field("Permamuted", user_is_permamuted)
         response.attachments[0].add_field("Tracked", user_is_tracked)
@@ -629,58 +877,9 @@ class RedditBot:
 
         if not no_summary:
             limit = 500
-            i = 0
-            total_comments = 0
-            subreddit_names = []
-            subreddit_total = []
-            ordered_subreddit_names = []
-            comments_in_subreddit = []
-            ordered_comments_in_subreddit = []
-            comment_lengths = []
-            history = {}
-            total_karma = 0
-            troll_index = 0
-            blacklisted_subreddits = ('theredpill', 'rage', 'atheism', 'conspiracy', 'the_donald', 'subredditcancer',
-                                      'SRSsucks', 'drama', 'undelete', 'blackout2015', 'oppression', 'kotakuinaction',
-                                      'tumblrinaction', 'offensivespeech', 'bixnood')
-            total_negative_karma = 0
-
-            x = []
-            y = []
-            s = []
-
-            karma_accumulator = 0
-            karma_accumulated = []
-            karma_accumulated_total = []
-
-            self.r._use_oauth = False
-            for comment in user.get_comments(limit=limit):
-
-                displayname = comment.subreddit.display_name
-
-                if displayname not in subreddit_names:
-                    subreddit_names.append(displayname)
-
-                subreddit_total.append(displayname)
-
-                total_karma = total_karma + comment.score
-
-                x.append(datetime.datetime.utcfromtimestamp(float(comment.created_utc)))
-                y.append(comment.score)
-                comment_lengths.append(len(comment.body.split()))
-
-                if comment.score < 0:
-                    total_negative_karma += comment.score
-
-                if len(comment.body) < 200:
-                    troll_index += 0.1
-
-                if displayname in blacklisted_subreddits:
-                    troll_index += 2.5
-
-                i += 1
-
-            total_comments_read = i
+            stats = summary_stats.SummaryStats.from_history(self.get_comment_history(user, limit=limit),
+                                                            comment_karma=user.comment_karma, limit=limit)
+            total_comments_read = stats.count
 
             if not total_comments_read:
                 response.add_attachment(fallback="Summary for /u/" + username,
@@ -689,111 +888,23 @@ class RedditBot:
 
                 return request.delayed_response(response)
 
-            troll_index *= limit / total_comments_read
-
-            average_karma = np.mean(y)
-
-            if average_karma >= 5 and total_negative_karma > (-70 * (total_comments_read / limit)) and troll_index < 50:
-                troll_likelihood = 'Low'
-                color = 'good'
-
-            if troll_index >= 40 or total_negative_karma < (-70 * (total_comments_read / limit)) or average_karma < 1:
-                troll_likelihood = 'Moderate'
-                color = 'warning'
+            troll_likelihood, color = stats.troll_likelihood()
+            ordered_subreddit_names, ordered_comments_in_subreddit = stats.subreddit_histogram()
 
-            if troll_index >= 60 or total_negative_karma < (-130 * (total_comments_read / limit)) or average_karma < -2:
-                troll_likelihood = 'High'
-                color = 'danger'
+            chart = charts.render_in_pool(charts.render_summary_chart, 'User summary for /u/' + user.name,
+                                          ordered_subreddit_names, ordered_comments_in_subreddit, stats.dates(),
+                                          stats.scores.tolist(), stats.marker_sizes(), float(stats.average_karma()),
+                                          stats.cumulative_karma())
 
-            if troll_index >= 80 or total_negative_karma < (-180 * (total_comments_read / limit)) or average_karma < -5:
-                troll_likelihood = 'Very high'
-                color = 'danger'
+            image_url = self.image_sink.upload(chart)
 
-            if troll_index >= 100 or total_negative_karma < (-200 * (total_comments_read / limit))\
-                    or average_karma < -10:
-                troll_likelihood = 'Extremely high'
-                color = 'danger'
-
-            for subreddit in subreddit_names:
-                i = subreddit_total.count(subreddit)
-                comments_in_subreddit.append(i)
-                total_comments += i
-
-            i = 0
-
-            for subreddit in subreddit_names:
-
-                if comments_in_subreddit[i] > (total_comments_read / (20 * (limit / 200)) /
-                                                   (len(subreddit_names) / 30)):
-                    history[subreddit] = comments_in_subreddit[i]
-
-                i += 1
-
-            old_range = 700 - 50
-            new_range = 2000 - 50
-
-            for item in comment_lengths:
-                n = (((item - 50) * new_range) / old_range) + 50
-                s.append(n)
-
-            history_tuples = sorted(history.items(), key=lambda xa: x[1])
-
-            for each_tuple in history_tuples:
-                ordered_subreddit_names.append(each_tuple[0])
-                ordered_comments_in_subreddit.append(each_tuple[1])
-
-            user_karma_atstart = user.comment_karma - math.fabs((np.mean(y) * total_comments_read))
-
-            for item in list(reversed(y)):
-                karma_accumulator += item
-                karma_accumulated.append(karma_accumulator)
-
-            for item in karma_accumulated:
-                karma_accumulated_total.append(user_karma_atstart + item)
-
-            plt.style.use('ggplot')
-            labels = ordered_subreddit_names
-            sizes = ordered_comments_in_subreddit
-            colors = ['yellowgreen', 'gold', 'lightskyblue', 'lightcoral', 'teal', 'chocolate', 'olivedrab', 'tan']
-            plt.subplot(3, 1, 1)
-            plt.rcParams['font.size'] = 8
-            plt.pie(sizes, labels=labels, colors=colors,
-                    autopct=None, startangle=90)
-            plt.axis('equal')
-            plt.title('User summary for /u/' + user.name, loc='center', y=1.2)
-
-            ax1 = plt.subplot(3, 1, 2)
-            x_inv = list(reversed(x))
-            plt.rcParams['font.size'] = 10
-            plt.scatter(x, y, c=y, vmin=-50, vmax=50, s=s, cmap='RdYlGn')
-            ax1.set_xlim(x_inv[0], x_inv[total_comments_read - 1])
-            ax1.axhline(y=average_karma, xmin=0, xmax=1, c="lightskyblue", linewidth=2, zorder=4)
-            plt.ylabel('Karma of comment')
-
-            ax2 = plt.subplot(3, 1, 3)
-            plt.plot_date(x, list(reversed(karma_accumulated_total)), '-r')
-            plt.xlabel('Comment date')
-            plt.ylabel('Total comment karma')
-
-            filename = username + "_summary.png"
-
-            figure = plt.gcf()
-            figure.set_size_inches(11, 12)
-
-            plt.savefig(filename)
-
-            path = os.getcwd() + "/" + filename
-
-            link = self.imgur.upload_from_path(path, config=None, anon=True)
-            os.remove(path)
-
-            plt.clf()
-
-            response.add_attachment(fallback="Summary for /u/" + username, image_url=link['link'],
+            response.add_attachment(fallback="Summary for /u/" + username, image_url=image_url,
                                     color=color)
             response.attachments[1].add_field("Troll likelihood", troll_likelihood)
             response.attachments[1].add_field("Total comments read", total_comments_read)
 
+        self.summaries.put(username, response.attachments, not no_summary, started)
+
         if request is not None:
             response = request.delayed_response(response)
 
@@ -841,6 +952,7 @@ class RedditBot:
 
                     self.r._use_oauth = False
                     self.un.add_note(n)
+                    self.summaries.invalidate(username)
 
                 response = utils.SlackResponse(text="User */u/%s* has been shadowbanned." % username)
                 response.add_attachment(fallback="Shadowbanned /u/" + username,
@@ -929,6 +1041,7 @@ class RedditBot:
 
         self.r._use_oauth = False
         self.un.add_note(n)
+        self.summaries.invalidate(user.name)
 
         response = utils.SlackResponse()
         response.add_attachment(text="Note added successfully!", color='good')
@@ -1,53 +1,369 @@
 import threading
 import traceback
+import queue
+import heapq
+import random
+import time
 from time import sleep
 import requests.exceptions
 import praw.errors
 
 
-class CreateThread(threading.Thread):
-    def __init__(self, thread_id, name, obj, method, kwargs=None):
-        threading.Thread.__init__(self)
-        self.threadID = thread_id
+class Job:
+
+    """A single call queued on a WorkerPool. Unless retry is False, it is retried on assertion and HTTP errors, as well
+    as unhandled exceptions, until its timeout runs out"""
+
+    def __init__(self, name, obj, method, kwargs, timeout, retry=True):
         self.name = name
         self.obj = obj
         self.method = method
         self.kwargs = kwargs
+        self.timeout = timeout
+        self.retry = retry
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
 
     def run(self):
 
-        # This loop will run when the thread raises an exception
+        self.started = time.time()
+        deadline = self.started + self.timeout
+
         while True:
+            self.attempts += 1
             try:
                 if self.kwargs is not None:
-                    methodToRun = self.method(self.obj, self.kwargs)
+                    self.result = self.method(self.obj, self.kwargs)
                 else:
-                    methodToRun = self.method(self.obj)
+                    self.result = self.method(self.obj)
                 break
             except AssertionError:
                 print("------------\nRan into an assertion error\nTrying again\n------------")
-                sleep(1)
                 print(traceback.format_exc())
-                continue
+                delay = 1
             except (requests.exceptions.HTTPError, praw.errors.HTTPException):
-                sleep(2)
-                continue
+                delay = 2
             except:
                 print("*Unhandled exception"
-                      " in thread* '%s'." % self.name)
+                      " in job* '%s'." % self.name)
                 print(traceback.format_exc())
-                sleep(10)
+                delay = 10
+
+            if not self.retry:
+                self.error = "Failed"
+                break
+
+            if time.time() + delay >= deadline:
+                self.error = "Timed out after %s attempts" % self.attempts
+                print("*Giving up on job* '%s': %s." % (self.name, self.error))
+                break
+
+            sleep(delay)
+
+        self.finished = time.time()
+        self._done.set()
+
+    def wait(self, timeout=None):
+
+        """Blocks until the job has finished or timeout seconds have passed. Returns True if the job finished"""
+
+        return self._done.wait(timeout)
+
+    def describe(self):
+
+        now = time.time()
+
+        if self.started is None:
+            state = "queued for %.1fs" % (now - self.submitted)
+        else:
+            state = "running for %.1fs" % (now - self.started)
+            if now - self.started > self.timeout:
+                state += " (overdue)"
+
+        return "%s: %s, attempt %s" % (self.name, state, self.attempts)
+
+
+class WorkerPool:
+
+    """Fixed number of worker threads fed by a bounded queue. Submitting to a full queue is rejected instead of
+    spawning more threads"""
+
+    def __init__(self, name, workers, max_queue, job_timeout):
+        self.name = name
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.in_flight = set()
+        self.rejected = 0
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name="%s worker %s" % (self.name, len(self._threads)))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+
+        while True:
+            job = self.queue.get()
+
+            with self._lock:
+                self.in_flight.add(job)
+
+            try:
+                job.run()
+            finally:
+                with self._lock:
+                    self.in_flight.discard(job)
+                self.queue.task_done()
+
+    def submit(self, obj, method, kwargs=None, name=None, timeout=None, retry=True):
+
+        """Queues method(obj[, kwargs]) and returns its Job, or None if the queue is full"""
+
+        if not self._threads:
+            self._start()
+
+        job = Job(name or str(method), obj, method, kwargs, timeout or self.job_timeout, retry)
+
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            self.rejected += 1
+            print("*Worker pool '%s' is full*, rejected job '%s'." % (self.name, job.name))
+            return None
+
+        return job
+
+    def status(self):
+
+        """Returns a human readable description of the pool's queue and in-flight jobs"""
+
+        with self._lock:
+            running = [job.describe() for job in self.in_flight]
+
+        status = "%s: %s/%s workers busy, %s queued (max %s), %s rejected\n" % (self.name, len(running), self.workers,
+                                                                                self.queue.qsize(),
+                                                                                self.queue.maxsize, self.rejected)
+        for line in running:
+            status += "    " + line + "\n"
+
+        return status
+
+
+class ScheduledTask:
+
+    """A periodic call owned by the Scheduler, along with its timing statistics. If the task has a target, func must
+    return the number of new items it found, and the interval is adjusted between min_interval and max_interval so
+    that each run finds about target items"""
+
+    def __init__(self, scheduler, name, func, interval, jitter, min_interval=None, max_interval=None, target=None):
+        self.scheduler = scheduler
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.min_interval = min_interval or interval
+        self.max_interval = max_interval or interval
+        self.target = target
+        self.item_rate = None
+        self.last_started = None
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0
+        self.max_duration = 0
+        self.total_duration = 0
+
+    def run(self):
+
+        started = time.time()
+        retry_delay = None
+
+        try:
+            found = self.func()
+            if self.target:
+                self.adapt(found, started)
+        except (requests.exceptions.HTTPError, praw.errors.HTTPException):
+            self.failures += 1
+            retry_delay = 10
+        except:
+            self.failures += 1
+            retry_delay = 30
+            print("*Unhandled exception in scheduled task* '%s'." % self.name)
+            print(traceback.format_exc())
+
+        self.last_duration = time.time() - started
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.total_duration += self.last_duration
+        self.runs += 1
+        self.running = False
+
+        if self.interval is None:
+            # One-shot task from call_later
+            return
+
+        if retry_delay is not None and retry_delay < self.interval:
+            self.scheduler.schedule(self, time.time() + retry_delay)
+        else:
+            self.scheduler.schedule(self)
+
+    def adapt(self, found, started):
+
+        """Updates a moving average of how many new items per second the task is finding and picks the interval
+        that would have found target of them. A run that finds twice the target drops straight to min_interval, and
+        when nothing is happening the interval backs off gradually"""
+
+        if self.last_started is not None and found is not None:
+            rate = found / max(started - self.last_started, 1)
+
+            if self.item_rate is None:
+                self.item_rate = rate
+            else:
+                self.item_rate = 0.5 * self.item_rate + 0.5 * rate
+
+            if found >= 2 * self.target:
+                # A full page of new items means we are probably falling behind
+                interval = self.min_interval
+            elif self.item_rate > 0:
+                interval = self.target / self.item_rate
+            else:
+                interval = self.interval * 1.5
+
+            self.interval = min(max(interval, self.min_interval), self.max_interval)
+
+        self.last_started = started
+
+    def set_bounds(self, min_interval, max_interval):
+
+        """Changes the range adapt() keeps the interval in. A pending run that is further away than the new
+        max_interval is brought forward"""
+
+        self.min_interval = min_interval or self.min_interval
+        self.max_interval = max_interval or self.max_interval
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+
+        if not self.running and self.next_run is not None and self.next_run > time.time() + self.max_interval:
+            self.scheduler.schedule(self)
+
+    def describe(self):
+
+        average = self.total_duration / self.runs if self.runs else 0
+
+        return "%s: every %.0fs, next in %.0fs, %s runs (%s failed), last %.1fs, avg %.1fs, max %.1fs" % (
+            self.name, self.interval, max(self.next_run - time.time(), 0), self.runs, self.failures,
+            self.last_duration, average, self.max_duration)
+
+
+class Scheduler:
+
+    """Owns the periodic tasks of every RedditBot. A single thread keeps them in a heap ordered by next run time and
+    hands due tasks to a worker pool, so a task never runs twice at once and idle pollers don't hold a thread each"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.tasks = dict()
+        self._heap = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add_task(self, name, func, interval, jitter=0.1, min_interval=None, max_interval=None, target=None):
+
+        """Runs func every interval seconds, give or take jitter * interval. The first run is staggered by up to the
+        same amount so that bots started together don't poll Reddit in lockstep. Passing a target makes the interval
+        adaptive, see ScheduledTask"""
+
+        task = ScheduledTask(self, name, func, interval, jitter, min_interval, max_interval, target)
+        self.tasks[name] = task
+        self.schedule(task, time.time() + random.uniform(0, jitter * interval))
+
+        return task
+
+    def call_later(self, delay, func, name):
+
+        """Runs func once, delay seconds from now"""
+
+        task = ScheduledTask(self, name, func, None, 0)
+        self.schedule(task, time.time() + delay)
+
+        return task
+
+    def schedule(self, task, when=None):
+
+        if when is None:
+            when = time.time() + task.interval * (1 + random.uniform(-task.jitter, task.jitter))
+
+        with self._cond:
+            task.next_run = when
+            self._counter += 1
+            heapq.heappush(self._heap, (when, self._counter, task))
+            self._cond.notify()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_forever, name="scheduler")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run_forever(self):
+
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+
+                when, counter, task = heapq.heappop(self._heap)
+
+            if task.next_run != when:
+                # Superseded by a later schedule() call
+                continue
+
+            task.running = True
+            if self.pool.submit(task, ScheduledTask.run, name=task.name) is None:
+                task.running = False
+                self.schedule(task, time.time() + 5)
+
+    def status(self, prefix=""):
+
+        status = ""
+
+        for name in sorted(self.tasks):
+            if name.startswith(prefix):
+                status += self.tasks[name].describe() + "\n"
+
+        return status
+
+
+# Short moderator actions triggered from Slack
+action_pool = WorkerPool("actions", workers=8, max_queue=64, job_timeout=300)
+
+# Periodic Reddit pollers, kept apart from the actions so that neither can starve the other
+poller_pool = WorkerPool("pollers", workers=4, max_queue=256, job_timeout=600)
+scheduler = Scheduler(poller_pool)
 
 
 def own_thread(func):
     def wrapped_f(*args, **kwargs):
-        # Create a thread with the method we called
+        # Queue the method we called on the action pool
         if not kwargs:
             kwargs = None
 
-        thread = CreateThread(1, str(func) + " thread", args[0], func, kwargs)
-        thread.start()
+        job = action_pool.submit(args[0], func, kwargs, name=func.__name__)
 
-    return wrapped_f
+        if job is None and kwargs is not None and kwargs.get('request') is not None:
+            kwargs['request'].delayed_response("RedditSlacker is busy right now, please try again in a minute.")
 
+        return job
 
+    return wrapped_f
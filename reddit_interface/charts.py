@@ -0,0 +1,81 @@
+import concurrent.futures
+import concurrent.futures.process
+import io
+import multiprocessing
+import threading
+import matplotlib
+import matplotlib.style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Charts are drawn in separate processes: pyplot's global state isn't thread safe, and rendering would hold the GIL
+# away from the request threads. Spawned workers don't inherit the locks held by the parent's threads
+RENDER_WORKERS = 2
+RENDER_TIMEOUT = 120
+
+PIE_COLORS = ['yellowgreen', 'gold', 'lightskyblue', 'lightcoral', 'teal', 'chocolate', 'olivedrab', 'tan']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def render_summary_chart(title, labels, sizes, dates, scores, marker_sizes, average_karma, karma_totals):
+
+    """Draws the three panel chart of a /user summary and returns it as PNG bytes. Takes plain lists, newest comment
+    first, so it can run in a worker process"""
+
+    with matplotlib.style.context('ggplot'):
+        figure = Figure(figsize=(11, 12))
+        FigureCanvasAgg(figure)
+
+        with matplotlib.rc_context({'font.size': 8}):
+            ax0 = figure.add_subplot(3, 1, 1)
+            ax0.pie(sizes, labels=labels, colors=PIE_COLORS, autopct=None, startangle=90)
+            ax0.axis('equal')
+            ax0.set_title(title, loc='center', y=1.2)
+
+        with matplotlib.rc_context({'font.size': 10}):
+            ax1 = figure.add_subplot(3, 1, 2)
+            ax1.scatter(dates, scores, c=scores, vmin=-50, vmax=50, s=marker_sizes, cmap='RdYlGn')
+            ax1.set_xlim(dates[-1], dates[0])
+            ax1.axhline(y=average_karma, xmin=0, xmax=1, c="lightskyblue", linewidth=2, zorder=4)
+            ax1.set_ylabel('Karma of comment')
+
+            ax2 = figure.add_subplot(3, 1, 3)
+            ax2.plot(dates, karma_totals, '-r')
+            ax2.set_xlabel('Comment date')
+            ax2.set_ylabel('Total comment karma')
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format='png')
+
+    return buffer.getvalue()
+
+
+def _get_pool():
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                                           mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def render_in_pool(func, *args):
+
+    """Runs a render function on the chart worker processes and returns its result, waiting up to RENDER_TIMEOUT
+    seconds. A pool that lost a worker is replaced on the next call"""
+
+    global _pool
+
+    pool = _get_pool()
+
+    try:
+        return pool.submit(func, *args).result(RENDER_TIMEOUT)
+    except concurrent.futures.process.BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
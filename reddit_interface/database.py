@@ -1,14 +1,197 @@
 import sqlite3
+import collections
 import reddit_interface.utils as utils
 import datetime
 import traceback
+import threading
+import contextlib
+import time
+import queue
+import atexit
+
+
+# Schema changes applied on top of the tables created in RedditSlackerDatabase.__init__. Each database records the last
+# version it was migrated to in PRAGMA user_version, so add new migrations at the end and never edit old ones
+MIGRATIONS = [
+    (1, ['''CREATE INDEX IF NOT EXISTS USER_TRACKS_NAME_NOCASE ON USER_TRACKS(USER_NAME COLLATE NOCASE)''',
+         '''CREATE INDEX IF NOT EXISTS BANS_LOG_NAME_NOCASE ON BANS_LOG(NAME COLLATE NOCASE)''',
+         '''CREATE INDEX IF NOT EXISTS USER_TRACKS_PERMAMUTED ON USER_TRACKS(PERMAMUTED) WHERE PERMAMUTED = 1''',
+         '''CREATE INDEX IF NOT EXISTS USER_TRACKS_TRACKED ON USER_TRACKS(TRACKED) WHERE TRACKED = 1''',
+         '''CREATE INDEX IF NOT EXISTS USER_TRACKS_SHADOWBANNED ON USER_TRACKS(SHADOWBANNED) WHERE SHADOWBANNED = 1''',
+         '''CREATE INDEX IF NOT EXISTS UNFLAIRED_SUBMISSIONS_ID ON UNFLAIRED_SUBMISSIONS(SUBMISSION_ID)''',
+         '''CREATE INDEX IF NOT EXISTS MODMAIL_THREADS_ACTIVITY ON MODMAIL_THREADS(LAST_ACTIVITY)''']),
+    # Usernames are compared case insensitively, so make them unique that way to allow upserts on them
+    (2, ['''DELETE FROM USER_TRACKS WHERE ID NOT IN
+            (SELECT MIN(ID) FROM USER_TRACKS GROUP BY USER_NAME COLLATE NOCASE)''',
+         '''DROP INDEX IF EXISTS USER_TRACKS_NAME_NOCASE''',
+         '''CREATE UNIQUE INDEX IF NOT EXISTS USER_TRACKS_NAME_NOCASE ON USER_TRACKS(USER_NAME COLLATE NOCASE)''']),
+    # Append-only modlog history, and per user counters over the last ROLLUP_WINDOWS days kept up to date from it
+    (3, ['''CREATE TABLE IF NOT EXISTS MOD_EVENTS
+            (ID INTEGER PRIMARY KEY,
+            USER_NAME TEXT NOT NULL COLLATE NOCASE,
+            ACTION INTEGER NOT NULL,
+            CREATED INTEGER NOT NULL)''',
+         '''CREATE INDEX IF NOT EXISTS MOD_EVENTS_CREATED ON MOD_EVENTS(CREATED)''',
+         '''CREATE TABLE IF NOT EXISTS USER_ROLLUPS
+            (USER_NAME TEXT NOT NULL COLLATE NOCASE,
+            WINDOW_DAYS INTEGER NOT NULL,
+            REMOVED_COMMENTS INTEGER NOT NULL DEFAULT 0,
+            REMOVED_SUBMISSIONS INTEGER NOT NULL DEFAULT 0,
+            BANS INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (USER_NAME, WINDOW_DAYS)) WITHOUT ROWID''']),
+    # Set when a full ban list sync no longer finds the user banned, cleared if they are banned again
+    (4, ['''ALTER TABLE BANS_LOG ADD COLUMN UNBANNED_AT TEXT''']),
+    # The fields of a user's recent comments that /user summaries need, so repeat summaries only fetch new comments
+    (5, ['''CREATE TABLE IF NOT EXISTS COMMENT_HISTORY
+            (USER_NAME TEXT NOT NULL COLLATE NOCASE,
+            COMMENT_ID TEXT NOT NULL,
+            CREATED INTEGER NOT NULL,
+            SCORE INTEGER NOT NULL,
+            SUBREDDIT TEXT NOT NULL,
+            WORDS INTEGER NOT NULL,
+            SHORT INTEGER NOT NULL,
+            PRIMARY KEY (USER_NAME, COMMENT_ID)) WITHOUT ROWID''',
+         '''CREATE INDEX IF NOT EXISTS COMMENT_HISTORY_CREATED ON COMMENT_HISTORY(USER_NAME, CREATED)''',
+         '''CREATE TABLE IF NOT EXISTS COMMENT_HISTORY_USERS
+            (USER_NAME TEXT PRIMARY KEY COLLATE NOCASE,
+            NEWEST_ID TEXT,
+            FULL_FETCH INTEGER NOT NULL,
+            LAST_USED INTEGER NOT NULL)''',
+         '''CREATE INDEX IF NOT EXISTS COMMENT_HISTORY_USERS_USED ON COMMENT_HISTORY_USERS(LAST_USED)''']),
+]
+
+# Counter columns shared by USER_TRACKS and USER_ROLLUPS. MOD_EVENTS.ACTION stores the index into this tuple
+TRACK_COLUMNS = ("REMOVED_COMMENTS", "REMOVED_SUBMISSIONS", "BANS")
+
+# Lengths in days of the rolling windows kept in USER_ROLLUPS
+ROLLUP_WINDOWS = (7, 30, 365)
+
+# Columns of USER_TRACKS counting each kind of modlog action
+MOD_LOG_COLUMNS = {"removecomment": "REMOVED_COMMENTS",
+                   "removelink": "REMOVED_SUBMISSIONS",
+                   "banuser": "BANS"}
+
+# Column of USER_TRACKS and the value each user status button sets it to
+USER_STATUS_COLUMNS = {"shadowban": ("SHADOWBANNED", 1),
+                       "unshadowban": ("SHADOWBANNED", 0),
+                       "permamute": ("PERMAMUTED", 1),
+                       "unpermamute": ("PERMAMUTED", 0),
+                       "track": ("TRACKED", 1),
+                       "untrack": ("TRACKED", 0)}
+
+# Lookups on hot paths and the table each of them must not scan, see RedditSlackerDatabase.check_query_plans
+HOT_QUERIES = [
+    ('USER_TRACKS', '''SELECT * FROM USER_TRACKS WHERE USER_NAME = ? COLLATE NOCASE''', ('user',)),
+    ('USER_TRACKS', '''SELECT * FROM USER_TRACKS WHERE PERMAMUTED = 1''', ()),
+    ('USER_TRACKS', '''SELECT * FROM USER_TRACKS WHERE SHADOWBANNED = 1''', ()),
+    ('USER_TRACKS', '''SELECT * FROM USER_TRACKS WHERE TRACKED = 1''', ()),
+    ('BANS_LOG', '''SELECT * FROM BANS_LOG WHERE NAME = ? COLLATE NOCASE''', ('user',)),
+    ('OP_RESPONSES', '''SELECT * FROM OP_RESPONSES WHERE SUBMISSION_ID = ?''', ('id',)),
+    ('UNFLAIRED_SUBMISSIONS', '''DELETE FROM UNFLAIRED_SUBMISSIONS WHERE SUBMISSION_ID = ?''', ('id',)),
+    ('SEEN_ITEMS', '''SELECT ITEM_ID, SEEN_AT FROM SEEN_ITEMS WHERE STREAM = ? ORDER BY SEEN_AT DESC LIMIT ?''',
+     ('stream', 1)),
+    ('MODMAIL_THREADS', '''DELETE FROM MODMAIL_THREADS WHERE LAST_ACTIVITY < ?''', (0,)),
+    ('USER_ROLLUPS', '''SELECT * FROM USER_ROLLUPS WHERE USER_NAME = ?''', ('user',)),
+    ('MOD_EVENTS', '''SELECT USER_NAME, ACTION, COUNT(*) FROM MOD_EVENTS WHERE CREATED >= ? AND CREATED < ?
+                    GROUP BY USER_NAME, ACTION''', (0, 1)),
+    ('COMMENT_HISTORY', '''SELECT CREATED, SCORE, SUBREDDIT, WORDS, SHORT FROM COMMENT_HISTORY WHERE USER_NAME = ?
+                         ORDER BY CREATED DESC LIMIT ?''', ('user', 1)),
+]
+
+
+class AuditLogWriter:
+
+    """Writes audit log rows from a background thread so that logging never delays a Slack request. Rows are
+    buffered in a bounded queue and written with executemany, up to batch_size of them per transaction. Rows added
+    while the queue is full are dropped"""
+
+    def __init__(self, database, max_queue=1000, batch_size=100, flush_interval=2):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, statement, row):
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="audit log writer")
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.flush, 10)
+
+        try:
+            self.queue.put_nowait((statement, row))
+        except queue.Full:
+            self.dropped += 1
+            print("*Audit log buffer is full*, dropped a row (%s dropped so far)." % self.dropped)
+
+    def _work(self):
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for item in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+
+        rows = collections.OrderedDict()
+
+        for statement, row in batch:
+            rows.setdefault(statement, []).append(row)
+
+        try:
+            with self.database.transaction() as cur:
+                for statement, statement_rows in rows.items():
+                    cur.executemany(statement, statement_rows)
+        except:
+            print("*Could not write* %s audit log rows." % len(batch))
+            print(traceback.format_exc())
+
+    def flush(self, timeout=None):
+
+        """Blocks until every buffered row has been written or timeout seconds have passed"""
+
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time() if deadline is not None else None
+
+                if remaining is not None and remaining <= 0:
+                    print("*Gave up flushing the audit log* with %s rows left." % self.queue.unfinished_tasks)
+                    return False
+
+                self.queue.all_tasks_done.wait(remaining)
+
+        return True
 
 
 class RedditSlackerDatabase:
 
-    def __init__(self, name, create_tables=True):
+    def __init__(self, name, create_tables=True, busy_timeout=30):
+
+        self.name = name
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self.audit_log = AuditLogWriter(self)
 
-        self.db = sqlite3.connect(name, check_same_thread=False, isolation_level=None)
+        # WAL lets the Slack request threads read while a poller is writing. The mode is stored in the database file
+        self.db.execute('''PRAGMA journal_mode = WAL''')
 
         if create_tables:
             self.db.execute('''CREATE TABLE IF NOT EXISTS COMMANDS_LOG
@@ -61,9 +244,112 @@ class RedditSlackerDatabase:
                             TRACKED INTEGER NOT NULL DEFAULT 0,
                             SHADOWBANNED INTEGER NOT NULL DEFAULT 0)''')
 
-    def log_command(self, form):
+            self.db.execute('''CREATE TABLE IF NOT EXISTS SEEN_ITEMS
+                (STREAM TEXT NOT NULL,
+                ITEM_ID TEXT NOT NULL,
+                SEEN_AT INTEGER NOT NULL,
+                PRIMARY KEY (STREAM, ITEM_ID))''')
+
+            self.db.execute('''CREATE INDEX IF NOT EXISTS SEEN_ITEMS_AGE ON SEEN_ITEMS(STREAM, SEEN_AT)''')
+
+            self.db.execute('''CREATE TABLE IF NOT EXISTS BOT_STATE
+                (KEY TEXT PRIMARY KEY,
+                VALUE TEXT)''')
+
+            self.db.execute('''CREATE TABLE IF NOT EXISTS MODMAIL_THREADS
+                (MODMAIL_ID TEXT PRIMARY KEY,
+                CHANNEL TEXT NOT NULL,
+                MESSAGE_TS TEXT NOT NULL,
+                PAGE INTEGER NOT NULL,
+                PAGE_REPLIES INTEGER NOT NULL,
+                REPLY_COUNT INTEGER NOT NULL,
+                LAST_ACTIVITY INTEGER NOT NULL)''')
+
+            self.migrate()
+
+            for problem in self.check_query_plans():
+                print("*Slow query* in %s: %s" % (name, problem))
+
+    def get_schema_version(self):
+
+        cur = self.db.cursor()
+        cur.execute('''PRAGMA user_version''')
+
+        return cur.fetchone()[0]
+
+    @property
+    def db(self):
+
+        """The calling thread's own connection to the database, opened on first use"""
+
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.name, timeout=self.busy_timeout, isolation_level=None)
+            # Safe with WAL: a power loss can only lose the last few commits, never corrupt the database
+            connection.execute('''PRAGMA synchronous = NORMAL''')
+            self._local.connection = connection
+
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+
+        """Runs the statements executed on the yielded cursor as one transaction. The write lock is taken up front,
+        so concurrent writers wait for each other (up to busy_timeout seconds) instead of failing halfway"""
+
+        cur = self.db.cursor()
+        cur.execute('''BEGIN IMMEDIATE''')
+
+        try:
+            yield cur
+        except:
+            cur.execute('''ROLLBACK''')
+            raise
+
+        cur.execute('''COMMIT''')
+
+    def migrate(self):
+
+        """Applies every migration newer than the database's schema version, each in its own transaction"""
+
+        version = self.get_schema_version()
+
+        for migration_version, statements in MIGRATIONS:
+            if migration_version <= version:
+                continue
+
+            with self.transaction() as cur:
+                for statement in statements:
+                    cur.execute(statement)
+                # PRAGMA doesn't take bound parameters
+                cur.execute('''PRAGMA user_version = %d''' % migration_version)
+
+            version = migration_version
+
+        return version
+
+    def check_query_plans(self):
+
+        """Runs EXPLAIN QUERY PLAN on the hot lookups and returns a description of each one that scans its whole
+        table instead of using an index"""
 
         cur = self.db.cursor()
+        problems = []
+
+        for table, query, params in HOT_QUERIES:
+            cur.execute('''EXPLAIN QUERY PLAN ''' + query, params)
+
+            for row in cur.fetchall():
+                words = row[-1].split()
+
+                if words[0] == "SCAN" and table in words and "USING" not in words:
+                    problems.append("%s (%s)" % (" ".join(query.split()), row[-1]))
+
+        return problems
+
+    def log_command(self, form):
+
         user_name = form.get('user_name')
         user_id = form.get('user_id')
         team_name = form.get('team_domain')
@@ -73,16 +359,13 @@ class RedditSlackerDatabase:
         command = form.get('command')
         args = form.get('text')
 
-        cur.execute('''INSERT INTO COMMANDS_LOG(USER_NAME, USER_ID, TEAM_NAME, TEAM_ID, CHANNEL_NAME, CHANNEL_ID,
-                          COMMAND, ARGS, DATETIME) VALUES(?,?,?,?,?,?,?,?,CURRENT_TIMESTAMP)''', (user_name, user_id,
-                                                                                                  team_name,
-                                                                                                  team_id, channel_name,
-                                                                                                  channel_id,
-                                                                                                  command, args))
+        self.audit_log.add('''INSERT INTO COMMANDS_LOG(USER_NAME, USER_ID, TEAM_NAME, TEAM_ID, CHANNEL_NAME,
+                           CHANNEL_ID, COMMAND, ARGS, DATETIME) VALUES(?,?,?,?,?,?,?,?,?)''',
+                           (user_name, user_id, team_name, team_id, channel_name, channel_id, command, args,
+                            self._timestamp()))
 
     def log_button(self, form):
 
-        cur = self.db.cursor()
         user_name = form.user
         user_id = form.user_id
         team_name = form.team_domain
@@ -91,26 +374,45 @@ class RedditSlackerDatabase:
         channel_id = form.get('channel_id')
         button_pressed = form.actions[0]['value']
 
-        cur.execute('''INSERT INTO BUTTONS_LOG(USER_NAME, USER_ID, TEAM_NAME, TEAM_ID, CHANNEL_NAME, CHANNEL_ID,
-            BUTTON_PRESSED, DATETIME) VALUES(?,?,?,?,?,?,?,CURRENT_TIMESTAMP)''', (user_name, user_id,
-                                                                                    team_name,
-                                                                                    team_id, channel_name,
-                                                                                    channel_id, button_pressed))
+        self.audit_log.add('''INSERT INTO BUTTONS_LOG(USER_NAME, USER_ID, TEAM_NAME, TEAM_ID, CHANNEL_NAME,
+                           CHANNEL_ID, BUTTON_PRESSED, DATETIME) VALUES(?,?,?,?,?,?,?,?)''',
+                           (user_name, user_id, team_name, team_id, channel_name, channel_id, button_pressed,
+                            self._timestamp()))
 
-    def log_ban(self, ban):
-        cur = self.db.cursor()
+    @staticmethod
+    def _timestamp():
 
-        date_time = datetime.datetime.fromtimestamp(ban['date'])
+        # Same format as CURRENT_TIMESTAMP, taken when the row is logged rather than when it's written
+        return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
-        try:
-            cur.execute('''INSERT INTO BANS_LOG(NAME, USER_ID, NOTE, DATE_TIME) VALUES (?,?,?,?)''', (ban['name'].name,
-                                                                                                      ban['id'],
-                                                                                                  ban['note'],
-                                                                                                      date_time))
-        except sqlite3.IntegrityError:
-            pass
-        except:
-            print(traceback.format_exc())
+    def log_bans(self, bans):
+
+        """Stores a list of bans from the subreddit's ban list in one transaction. Bans already stored are left
+        alone, unless the user had been unbanned since"""
+
+        rows = [(ban['name'].name, ban['id'], ban['note'], str(datetime.datetime.fromtimestamp(ban['date'])))
+                for ban in bans]
+
+        with self.transaction() as cur:
+            cur.executemany('''INSERT INTO BANS_LOG(NAME, USER_ID, NOTE, DATE_TIME) VALUES (?,?,?,?)
+                            ON CONFLICT(USER_ID) DO UPDATE SET NAME = excluded.NAME, NOTE = excluded.NOTE,
+                            DATE_TIME = excluded.DATE_TIME, UNBANNED_AT = NULL
+                            WHERE BANS_LOG.UNBANNED_AT IS NOT NULL''', rows)
+
+    def record_unbans(self, banned_ids):
+
+        """Takes the IDs of every user on the subreddit's ban list and marks the stored bans missing from it as
+        lifted. Returns how many were"""
+
+        banned_ids = set(banned_ids)
+
+        with self.transaction() as cur:
+            cur.execute('''SELECT USER_ID FROM BANS_LOG WHERE UNBANNED_AT IS NULL''')
+            unbanned = [(row[0],) for row in cur.fetchall() if row[0] not in banned_ids]
+
+            cur.executemany('''UPDATE BANS_LOG SET UNBANNED_AT = CURRENT_TIMESTAMP WHERE USER_ID = ?''', unbanned)
+
+        return len(unbanned)
 
     def get_ban_note(self, username):
         cur = self.db.cursor()
@@ -123,47 +425,47 @@ class RedditSlackerDatabase:
         else:
             return ban[3], ban[4]
 
-    def handle_mod_log(self, log):
+    def handle_mod_log(self, log, window_days=None):
+
+        """Counts a modlog action against its target. Returns the user's counters over the last window_days days,
+        or over their whole history if window_days isn't one of ROLLUP_WINDOWS"""
 
         if log.mod.lower() == "eli5_botmod":
             return None
 
-        cur = self.db.cursor()
+        column = MOD_LOG_COLUMNS.get(log.action)
+
+        if column is None:
+            return None
+
         username = log.target_author
-        log_type = log.action
+        created = int(log.created_utc)
 
-        user_comment_removals = 0
-        user_link_removals = 0
-        user_bans = 0
+        with self.transaction() as cur:
+            cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, %s) VALUES (?, 1)
+                        ON CONFLICT(USER_NAME COLLATE NOCASE) DO UPDATE SET %s = %s + 1
+                        RETURNING REMOVED_COMMENTS, REMOVED_SUBMISSIONS, BANS''' % (column, column, column),
+                        (username,))
+            counters = cur.fetchall()[0]
 
-        cur.execute('''SELECT * FROM USER_TRACKS WHERE USER_NAME = ? COLLATE NOCASE''', (username,))
-        user_track = cur.fetchone()
+            cur.execute('''INSERT INTO MOD_EVENTS(USER_NAME, ACTION, CREATED) VALUES (?,?,?)''',
+                        (username, TRACK_COLUMNS.index(column), created))
 
-        if user_track is not None:
-            user_comment_removals = user_track[2]
-            user_link_removals = user_track[3]
-            user_bans = user_track[4]
-
-        if log_type == "removelink":
-            user_link_removals += 1
-        elif log_type == "banuser":
-            user_bans += 1
-        elif log_type == "removecomment":
-            user_comment_removals += 1
-        else:
-            return None
+            for window in ROLLUP_WINDOWS:
+                # Events from before the window's expiry watermark have already been dropped from its counters
+                if created < self._get_rollup_watermark(cur, window):
+                    continue
 
-        if user_track is not None:
+                cur.execute('''INSERT INTO USER_ROLLUPS(USER_NAME, WINDOW_DAYS, %s) VALUES (?,?,1)
+                            ON CONFLICT(USER_NAME, WINDOW_DAYS) DO UPDATE SET %s = %s + 1''' % (column, column, column),
+                            (username, window))
 
-            cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                                REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                                VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                             user_comment_removals,
-                                                             user_link_removals,
-                                                             user_bans, user_track[5], user_track[6], user_track[7]))
-        else:
-            cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, REMOVED_COMMENTS, REMOVED_SUBMISSIONS, BANS)
-                                VALUES(?,?,?,?)''', (username, user_comment_removals, user_link_removals, user_bans))
+            if window_days in ROLLUP_WINDOWS:
+                cur.execute('''SELECT REMOVED_COMMENTS, REMOVED_SUBMISSIONS, BANS FROM USER_ROLLUPS
+                            WHERE USER_NAME = ? AND WINDOW_DAYS = ?''', (username, window_days))
+                counters = cur.fetchone() or (0, 0, 0)
+
+        user_comment_removals, user_link_removals, user_bans = counters
 
         return_dict = {"username": username, "comment_removals": user_comment_removals,
                        "link_removals": user_link_removals,
@@ -173,18 +475,94 @@ class RedditSlackerDatabase:
 
     def reset_user_tracks(self):
 
+        """Zeroes every user's counters, both the lifetime ones and those of the rolling windows"""
+
+        with self.transaction() as cur:
+            cur.execute('''UPDATE USER_TRACKS SET REMOVED_COMMENTS = 0, REMOVED_SUBMISSIONS = 0, BANS = 0''')
+            cur.execute('''DELETE FROM USER_ROLLUPS''')
+            cur.execute('''DELETE FROM MOD_EVENTS''')
+
+    def decay_user_tracks(self, after_id, limit):
+
+        """Halves the lifetime removal and ban counters of the next limit users with an ID above after_id. The rolling
+        windows age out on their own and are left alone. Returns the last ID it went through, or None once there are no
+        users left"""
+
+        with self.transaction() as cur:
+            cur.execute('''SELECT MAX(ID) FROM (SELECT ID FROM USER_TRACKS WHERE ID > ? ORDER BY ID LIMIT ?)''',
+                        (after_id, limit))
+            last_id = cur.fetchone()[0]
+
+            if last_id is not None:
+                cur.execute('''UPDATE USER_TRACKS SET REMOVED_COMMENTS = REMOVED_COMMENTS / 2,
+                            REMOVED_SUBMISSIONS = REMOVED_SUBMISSIONS / 2, BANS = BANS / 2
+                            WHERE ID > ? AND ID <= ? AND REMOVED_COMMENTS + REMOVED_SUBMISSIONS + BANS > 0''',
+                            (after_id, last_id))
+
+        return last_id
+
+    @staticmethod
+    def _get_rollup_watermark(cur, window):
+
+        cur.execute('''SELECT VALUE FROM BOT_STATE WHERE KEY = ?''', ("rollup_watermark_%s" % window,))
+        row = cur.fetchone()
+
+        if row is None:
+            return 0
+        else:
+            return int(row[0])
+
+    def expire_rollups(self, now=None):
+
+        """Takes the events that have slid out of each window since the last call off that window's counters, then
+        drops the events that are older than every window. Returns how many counters were updated"""
+
+        now = int(now or time.time())
+        updated = 0
+
+        with self.transaction() as cur:
+            for window in ROLLUP_WINDOWS:
+                watermark = self._get_rollup_watermark(cur, window)
+                cutoff = now - window * 86400
+
+                if cutoff <= watermark:
+                    continue
+
+                cur.execute('''SELECT USER_NAME, ACTION, COUNT(*) FROM MOD_EVENTS WHERE CREATED >= ? AND CREATED < ?
+                            GROUP BY USER_NAME, ACTION''', (watermark, cutoff))
+
+                for username, action, count in cur.fetchall():
+                    column = TRACK_COLUMNS[action]
+                    cur.execute('''UPDATE USER_ROLLUPS SET %s = MAX(%s - ?, 0)
+                                WHERE USER_NAME = ? AND WINDOW_DAYS = ?''' % (column, column),
+                                (count, username, window))
+                    updated += 1
+
+                cur.execute('''DELETE FROM USER_ROLLUPS WHERE WINDOW_DAYS = ?
+                            AND REMOVED_COMMENTS = 0 AND REMOVED_SUBMISSIONS = 0 AND BANS = 0''', (window,))
+                cur.execute('''INSERT OR REPLACE INTO BOT_STATE(KEY, VALUE) VALUES (?,?)''',
+                            ("rollup_watermark_%s" % window, cutoff))
+
+            cur.execute('''DELETE FROM MOD_EVENTS WHERE CREATED < ?''',
+                        (self._get_rollup_watermark(cur, max(ROLLUP_WINDOWS)),))
+
+        return updated
+
+    def fetch_user_rollups(self, username):
+
+        """Returns a dict of window length in days to the user's (comment removals, submission removals, bans) in
+        that window"""
+
         cur = self.db.cursor()
+        cur.execute('''SELECT WINDOW_DAYS, REMOVED_COMMENTS, REMOVED_SUBMISSIONS, BANS FROM USER_ROLLUPS
+                    WHERE USER_NAME = ?''', (username,))
+
+        rollups = dict((window, (0, 0, 0)) for window in ROLLUP_WINDOWS)
 
-        cur.execute('''SELECT * FROM USER_TRACKS''')
-        user_tracks = cur.fetchall()
+        for row in cur.fetchall():
+            rollups[row[0]] = tuple(row[1:])
 
-        for track in user_tracks:
-            cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                VALUES(?,?,?,?,?,?,?,?)''', (track[0], track[1],
-                                             0,
-                                             0,
-                                             0, track[5], track[6], track[7]))
+        return rollups
 
     def fetch_user_log(self, username):
 
@@ -239,75 +617,15 @@ class RedditSlackerDatabase:
         return cur.fetchall()
 
     def update_user_status(self, username, status_name):
-        cur = self.db.cursor()
 
-        cur.execute('''SELECT * FROM USER_TRACKS WHERE USER_NAME = ? COLLATE NOCASE''', (username,))
-        user_track = cur.fetchone()
-
-        if user_track is not None:
-
-            if status_name == "shadowban":
-                cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                    REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                    VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                 user_track[2],
-                                                 user_track[3],
-                                                 user_track[4], user_track[5], user_track[6], 1))
-            elif status_name == "permamute":
-                cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                    REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                    VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                 user_track[2],
-                                                 user_track[3],
-                                                 user_track[4], 1, user_track[6], user_track[7]))
-            elif status_name == "track":
-                cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                    REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                    VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                 user_track[2],
-                                                 user_track[3],
-                                                 user_track[4], user_track[5], 1, user_track[7]))
-            elif status_name == "untrack":
-                cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                    REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                    VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                 user_track[2],
-                                                 user_track[3],
-                                                 user_track[4], user_track[5], 0, user_track[7]))
-            elif status_name == "unpermamute":
-                cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                    REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                    VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                 user_track[2],
-                                                 user_track[3],
-                                                 user_track[4], 0, user_track[6], user_track[7]))
-            elif status_name == "unshadowban":
-                cur.execute('''REPLACE INTO USER_TRACKS(ID, USER_NAME, REMOVED_COMMENTS,
-                    REMOVED_SUBMISSIONS, BANS, PERMAMUTED, TRACKED, SHADOWBANNED)
-                    VALUES(?,?,?,?,?,?,?,?)''', (user_track[0], username,
-                                                 user_track[2],
-                                                 user_track[3],
-                                                 user_track[4], user_track[5], user_track[6], 0))
+        if status_name not in USER_STATUS_COLUMNS:
+            return
 
-        else:
-            if status_name == "shadowban":
-                cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, SHADOWBANNED)
-                    VALUES(?,?)''', (username, 1))
-            elif status_name == "permamute":
-                cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, PERMAMUTED)
-                    VALUES(?,?)''', (username, 1))
-            elif status_name == "track":
-                cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, TRACKED)
-                    VALUES(?,?)''', (username, 1))
-            elif status_name == "untrack":
-                cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, TRACKED)
-                    VALUES(?,?)''', (username, 0))
-            elif status_name == "unpermamute":
-                cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, PERMAMUTED)
-                    VALUES(?,?)''', (username, 0))
-            elif status_name == "unshadowban":
-                cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, SHADOWBANNED)
-                    VALUES(?,?)''', (username, 0))
+        column, value = USER_STATUS_COLUMNS[status_name]
+        cur = self.db.cursor()
+        cur.execute('''INSERT INTO USER_TRACKS(USER_NAME, %s) VALUES (?,?)
+                    ON CONFLICT(USER_NAME COLLATE NOCASE) DO UPDATE SET %s = excluded.%s''' % (column, column, column),
+                    (username, value))
 
     def log_unflaired_submission(self, submission_id, comment_id):
 
@@ -321,14 +639,14 @@ class RedditSlackerDatabase:
         cur.execute('''SELECT * FROM UNFLAIRED_SUBMISSIONS''')
         data = cur.fetchall()
 
+        things = utils.get_things(r, ["t3_" + row[1] for row in data] + ["t1_" + row[2] for row in data])
         unflaired_submissions = []
 
         for row in data:
-            r._use_oauth = False
-            submission = r.get_submission(submission_id=row[1])
-            if submission.banned_by is not None:
-                r._use_oauth = False
-                comment = r.get_info(thing_id="t1_" + row[2])
+            submission = things.get("t3_" + row[1])
+            comment = things.get("t1_" + row[2])
+
+            if submission is not None and comment is not None and submission.banned_by is not None:
                 unflaired_submission_obj = utils.UnflairedSubmission(submission, comment)
                 unflaired_submissions.append(unflaired_submission_obj)
 
@@ -342,24 +660,128 @@ class RedditSlackerDatabase:
     def add_submission_op_reply(self, submission_id):
 
         cur = self.db.cursor()
-        cur.execute('''SELECT * FROM OP_RESPONSES WHERE SUBMISSION_ID = ?''', (submission_id,))
-        row = cur.fetchone()
-
-        if row is not None:
-            response_count = row[2] + 1
-            cur.execute('''REPLACE INTO OP_RESPONSES(ID, SUBMISSION_ID, RESPONSE_COUNT) VALUES (?,?,?)''',
-                        (row[0], row[1], response_count))
-        else:
-            response_count = 1
-            cur.execute('''INSERT INTO OP_RESPONSES(SUBMISSION_ID, RESPONSE_COUNT) VALUES (?,?)''',
-                        (submission_id, response_count))
+        cur.execute('''INSERT INTO OP_RESPONSES(SUBMISSION_ID, RESPONSE_COUNT) VALUES (?, 1)
+                    ON CONFLICT(SUBMISSION_ID) DO UPDATE SET RESPONSE_COUNT = RESPONSE_COUNT + 1
+                    RETURNING RESPONSE_COUNT''', (submission_id,))
+        response_count = cur.fetchall()[0][0]
 
         if response_count > 3:
             return True
         else:
             return False
 
+    def fetch_seen_items(self, stream, limit):
+
+        """Returns the newest (item_id, seen_at) pairs recorded for a stream, oldest first"""
+
+        cur = self.db.cursor()
+        cur.execute('''SELECT ITEM_ID, SEEN_AT FROM SEEN_ITEMS WHERE STREAM = ? ORDER BY SEEN_AT DESC LIMIT ?''',
+                    (stream, limit))
+
+        return list(reversed(cur.fetchall()))
+
+    def count_seen_items(self):
+
+        cur = self.db.cursor()
+        cur.execute('''SELECT COUNT(*) FROM SEEN_ITEMS''')
+
+        return cur.fetchone()[0]
+
+    def log_seen_items(self, rows, prune_before=None):
+
+        """Takes an iterable of (stream, item_id, seen_at) tuples, and optionally a dict of stream to the seen_at
+        below which that stream's rows are dropped. Everything is written in one transaction"""
+
+        with self.transaction() as cur:
+            cur.executemany('''INSERT OR REPLACE INTO SEEN_ITEMS(STREAM, ITEM_ID, SEEN_AT) VALUES (?,?,?)''', rows)
+
+            for stream, seen_before in (prune_before or {}).items():
+                cur.execute('''DELETE FROM SEEN_ITEMS WHERE STREAM = ? AND SEEN_AT < ?''', (stream, seen_before))
+
+    def get_state(self, key, default=None):
+
+        cur = self.db.cursor()
+        cur.execute('''SELECT VALUE FROM BOT_STATE WHERE KEY = ?''', (key,))
+        row = cur.fetchone()
+
+        if row is None:
+            return default
+        else:
+            return row[0]
+
+    def set_state(self, key, value):
+
+        cur = self.db.cursor()
+        cur.execute('''INSERT OR REPLACE INTO BOT_STATE(KEY, VALUE) VALUES (?,?)''', (key, value))
+
+    def get_modmail_thread(self, modmail_id):
+
+        """Returns (channel, message_ts, page, page_replies, reply_count) for a modmail thread mirrored in Slack"""
+
+        cur = self.db.cursor()
+        cur.execute('''SELECT CHANNEL, MESSAGE_TS, PAGE, PAGE_REPLIES, REPLY_COUNT FROM MODMAIL_THREADS
+                    WHERE MODMAIL_ID = ?''', (modmail_id,))
+
+        return cur.fetchone()
+
+    def save_modmail_thread(self, modmail_id, channel, message_ts, page, page_replies, reply_count):
 
+        cur = self.db.cursor()
+        cur.execute('''INSERT OR REPLACE INTO MODMAIL_THREADS(MODMAIL_ID, CHANNEL, MESSAGE_TS, PAGE, PAGE_REPLIES,
+                    REPLY_COUNT, LAST_ACTIVITY) VALUES (?,?,?,?,?,?,strftime('%s','now'))''',
+                    (modmail_id, channel, message_ts, page, page_replies, reply_count))
+
+    def get_comment_history_user(self, username):
+
+        """Returns (newest cached comment ID, time of the last full fetch) for a user, or None if nothing is cached"""
+
+        cur = self.db.cursor()
+        cur.execute('''SELECT NEWEST_ID, FULL_FETCH FROM COMMENT_HISTORY_USERS WHERE USER_NAME = ?''', (username,))
+
+        return cur.fetchone()
+
+    def save_comment_history(self, username, rows, newest_id, full_fetch, replace=False, keep=500):
+
+        """Takes (comment_id, created, score, subreddit, words, short) rows for a user's comments. With replace, they
+        take the place of everything cached for the user. Only the keep newest comments are kept"""
+
+        with self.transaction() as cur:
+            if replace:
+                cur.execute('''DELETE FROM COMMENT_HISTORY WHERE USER_NAME = ?''', (username,))
+
+            cur.executemany('''INSERT OR REPLACE INTO COMMENT_HISTORY(USER_NAME, COMMENT_ID, CREATED, SCORE, SUBREDDIT,
+                            WORDS, SHORT) VALUES (?,?,?,?,?,?,?)''', [(username,) + tuple(row) for row in rows])
+
+            if rows and not replace:
+                cur.execute('''DELETE FROM COMMENT_HISTORY WHERE USER_NAME = ? AND COMMENT_ID NOT IN
+                            (SELECT COMMENT_ID FROM COMMENT_HISTORY WHERE USER_NAME = ?
+                            ORDER BY CREATED DESC LIMIT ?)''',
+                            (username, username, keep))
 
+            cur.execute('''INSERT OR REPLACE INTO COMMENT_HISTORY_USERS(USER_NAME, NEWEST_ID, FULL_FETCH, LAST_USED)
+                        VALUES (?,?,?,strftime('%s','now'))''', (username, newest_id, full_fetch))
 
+    def fetch_comment_history(self, username, limit):
 
+        """Returns (created, score, subreddit, words, short) for the user's newest cached comments, newest first"""
+
+        cur = self.db.cursor()
+        cur.execute('''SELECT CREATED, SCORE, SUBREDDIT, WORDS, SHORT FROM COMMENT_HISTORY WHERE USER_NAME = ?
+                    ORDER BY CREATED DESC LIMIT ?''', (username, limit))
+
+        return cur.fetchall()
+
+    def prune_comment_history(self, idle_seconds):
+
+        """Forgets the comment history of users who haven't been summarised for idle_seconds"""
+
+        with self.transaction() as cur:
+            cur.execute('''DELETE FROM COMMENT_HISTORY WHERE USER_NAME IN (SELECT USER_NAME FROM COMMENT_HISTORY_USERS
+                        WHERE LAST_USED < strftime('%s','now') - ?)''', (idle_seconds,))
+            cur.execute('''DELETE FROM COMMENT_HISTORY_USERS WHERE LAST_USED < strftime('%s','now') - ?''',
+                        (idle_seconds,))
+
+    def prune_modmail_threads(self, idle_seconds):
+
+        cur = self.db.cursor()
+        cur.execute('''DELETE FROM MODMAIL_THREADS WHERE LAST_ACTIVITY < strftime('%s','now') - ?''', (idle_seconds,))
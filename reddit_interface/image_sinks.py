@@ -0,0 +1,99 @@
+import abc
+import base64
+import collections
+import hashlib
+import os
+import threading
+
+
+class ImageSink(abc.ABC):
+
+    """Publishes images and returns their URLs. Uploads are cached by a hash of the image's content, so the same image
+    is never uploaded twice, even when two threads ask for it at once"""
+
+    def __init__(self, max_cached=500):
+        self.max_cached = max_cached
+        self.uploads = 0
+        self.cache_hits = 0
+        self._cache = collections.OrderedDict()
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _upload(self, image, key):
+
+        """Publishes image, whose content hash is key, and returns its URL"""
+
+    def upload(self, image):
+
+        key = hashlib.sha256(image).hexdigest()
+
+        while True:
+            with self._lock:
+                url = self._cache.get(key)
+
+                if url is not None:
+                    self._cache.move_to_end(key)
+                    self.cache_hits += 1
+                    return url
+
+                pending = self._pending.get(key)
+
+                if pending is None:
+                    self._pending[key] = threading.Event()
+                    break
+
+            # Another thread is uploading the same image, use its URL unless that upload fails
+            pending.wait()
+
+        try:
+            url = self._upload(image, key)
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+        with self._lock:
+            self.uploads += 1
+            self._cache[key] = url
+
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+        return url
+
+
+class ImgurSink(ImageSink):
+
+    """Uploads images anonymously to Imgur with an imgurpython ImgurClient"""
+
+    def __init__(self, client, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+
+    def _upload(self, image, key):
+
+        data = {'image': base64.b64encode(image).decode('ascii'), 'type': 'base64'}
+
+        return self.client.make_request('POST', 'upload', data, True)['link']
+
+
+class DirectorySink(ImageSink):
+
+    """Saves images to a local directory under their content hash, as a stand-in for Imgur in tests and development.
+    URLs are base_url followed by the file name"""
+
+    def __init__(self, directory, base_url=None, extension='png', **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.base_url = base_url or 'file://' + os.path.abspath(directory) + '/'
+        self.extension = extension
+
+    def _upload(self, image, key):
+
+        filename = key + '.' + self.extension
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(os.path.join(self.directory, filename), 'wb') as image_file:
+            image_file.write(image)
+
+        return self.base_url + filename
@@ -0,0 +1,291 @@
+import heapq
+import re
+import threading
+import time
+import traceback
+import requests
+import requests.adapters
+import requests.exceptions
+
+SLACK_API_URL = 'https://slack.com/api/'
+
+
+class TokenBucket:
+
+    """Allows rate calls per second on average, with bursts of up to capacity calls"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.time()
+
+    def reserve(self):
+
+        """Takes a token and returns how many seconds the caller has to wait before using it"""
+
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0
+        else:
+            return -self.tokens / self.rate
+
+
+class SlackDispatcher:
+
+    """Sends every outbound Slack call through one keep-alive connection pool. Calls to the same channel are paced
+    with a token bucket, 429 responses are retried after the Retry-After delay, and calls nobody waits for are sent
+    from a bounded background queue so pollers don't block on Slack"""
+
+    def __init__(self, workers=2, max_queue=500, max_retries=5, channel_rate=1.0, channel_burst=3, timeout=10):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.timeout = timeout
+        self.dropped = 0
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount('https://', adapter)
+
+        self._buckets = dict()
+        self._blocked_until = dict()
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _blocked_for(self, key):
+
+        with self._lock:
+            return self._blocked_until.get(key, 0) - time.time()
+
+    def _reserve_slot(self, key):
+
+        """Books the next send for key and returns how many seconds to wait before it"""
+
+        with self._lock:
+            delay = self._blocked_until.get(key, 0) - time.time()
+
+            if key is not None:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.channel_rate, self.channel_burst)
+                    self._buckets[key] = bucket
+
+                delay = max(delay, bucket.reserve())
+
+        return delay
+
+    def _send(self, url, params, data, headers, key, paced=False):
+
+        """Sends one request, returning the response or None if Slack asked us to back off. Unless the caller has
+        already waited for its slot (paced), this blocks until key may be sent to"""
+
+        if not paced:
+            delay = self._reserve_slot(key)
+            if delay > 0:
+                time.sleep(delay)
+
+        response = self.session.post(url, params=params, data=data, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 429:
+            retry_after = int(response.headers.get('Retry-After', 1))
+
+            with self._lock:
+                self._blocked_until[key] = time.time() + retry_after
+
+            return None
+
+        return response
+
+    def request(self, url, params=None, data=None, headers=None, key=None):
+
+        """Sends a request right away and waits for it, retrying on rate limits. key is the channel (or anything
+        else) the request should be paced by"""
+
+        for attempt in range(self.max_retries):
+            response = self._send(url, params, data, headers, key)
+            if response is not None:
+                return response
+
+        print("*Gave up on Slack request* to %s after %s rate limited attempts." % (url, self.max_retries))
+        return None
+
+    def call(self, method, data, channel=None):
+
+        """Calls a Slack Web API method and returns the decoded reply, or an empty dict if it failed. Calls without
+        a channel are paced per method, as Slack rate limits them"""
+
+        response = self.request(SLACK_API_URL + method, data=data, key=channel or method)
+
+        try:
+            return response.json()
+        except (AttributeError, ValueError):
+            return dict()
+
+    def call_async(self, method, data, channel=None):
+
+        """Queues a Slack Web API call to be sent in the background. Returns False if the queue is full"""
+
+        return self._enqueue(SLACK_API_URL + method, None, data, None, channel or method)
+
+    def request_async(self, url, data=None, headers=None, key=None):
+        return self._enqueue(url, None, data, headers, key)
+
+    def _enqueue(self, url, params, data, headers, key, attempt=0, when=None):
+
+        with self._cond:
+            if attempt == 0 and len(self._heap) >= self.max_queue:
+                self.dropped += 1
+                print("*Slack queue is full*, dropped a call to %s (%s dropped so far)." % (url, self.dropped))
+                return False
+
+            self._push(when or time.time(), (url, params, data, headers, key, attempt, False))
+
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name="slack dispatcher %s" % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        return True
+
+    def _push(self, when, item):
+
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (when, self._counter, item))
+            self._cond.notify()
+
+    def _work(self):
+
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+
+                when, counter, item = heapq.heappop(self._heap)
+
+            url, params, data, headers, key, attempt, paced = item
+
+            # Calls that have to wait for their channel go back on the queue, so the workers keep sending to the
+            # other channels in the meantime. A blocked channel books its slot once the block is over
+            blocked_for = self._blocked_for(key)
+
+            if blocked_for > 0:
+                self._push(time.time() + blocked_for, (url, params, data, headers, key, attempt, False))
+                continue
+
+            if not paced:
+                delay = self._reserve_slot(key)
+
+                if delay > 0:
+                    self._push(time.time() + delay, (url, params, data, headers, key, attempt, True))
+                    continue
+
+            try:
+                response = self._send(url, params, data, headers, key, paced=True)
+                retry_delay = None
+
+                if response is None:
+                    retry_delay = max(self._blocked_until.get(key, 0) - time.time(), 1)
+            except requests.exceptions.RequestException:
+                print(traceback.format_exc())
+                retry_delay = 2 ** attempt
+
+            if retry_delay is not None:
+                if attempt + 1 < self.max_retries:
+                    self._enqueue(url, params, data, headers, key, attempt + 1, time.time() + retry_delay)
+                else:
+                    self.dropped += 1
+                    print("*Gave up on Slack call* to %s after %s attempts." % (url, self.max_retries))
+
+    def status(self):
+
+        with self._cond:
+            queued = len(self._heap)
+
+        return "slack: %s queued (max %s), %s dropped\n" % (queued, self.max_queue, self.dropped)
+
+
+class ChannelDirectory:
+
+    """Resolves channel names such as '#rs_feed' to channel IDs, once per Slack team. Each team is identified by the
+    token used to post to it. The directory is reloaded after max_age seconds, or sooner (at most every min_refresh
+    seconds) when asked for a channel it doesn't know. Names that can't be resolved are returned unchanged"""
+
+    channel_id_pattern = re.compile(r'^[CGD][A-Z0-9]{6,}$')
+
+    def __init__(self, dispatcher, max_age=6 * 3600, min_refresh=300):
+        self.dispatcher = dispatcher
+        self.max_age = max_age
+        self.min_refresh = min_refresh
+        self._teams = dict()
+        self._team_locks = dict()
+        self._lock = threading.Lock()
+
+    def _needs_load(self, token, name):
+
+        loaded_at, channel_ids = self._teams.get(token, (0, dict()))
+        age = time.time() - loaded_at
+
+        return age > self.max_age or (name not in channel_ids and age > self.min_refresh)
+
+    def resolve(self, token, channel):
+
+        if channel is None or self.channel_id_pattern.match(channel):
+            return channel
+
+        name = channel.lstrip('#')
+
+        if self._needs_load(token, name):
+            with self._lock:
+                team_lock = self._team_locks.setdefault(token, threading.Lock())
+
+            # Only callers for the same team wait on a listing, and the first one to get the lock does the loading
+            with team_lock:
+                if self._needs_load(token, name):
+                    self._teams[token] = (time.time(), self._load(token))
+
+        return self._teams.get(token, (0, dict()))[1].get(name, channel)
+
+    def invalidate(self, token):
+        self._teams.pop(token, None)
+
+    def _load(self, token):
+
+        channel_ids = dict()
+        cursor = None
+
+        while True:
+            params = {'token': token, 'types': 'public_channel,private_channel', 'exclude_archived': 'true',
+                      'limit': 1000}
+            if cursor:
+                params['cursor'] = cursor
+
+            reply = self.dispatcher.call('conversations.list', params)
+
+            if not reply.get('ok'):
+                print("Could not list Slack channels: %s" % reply.get('error', 'no response'))
+                break
+
+            for channel in reply.get('channels', []):
+                channel_ids[channel['name']] = channel['id']
+
+            cursor = reply.get('response_metadata', dict()).get('next_cursor')
+            if not cursor:
+                break
+
+        return channel_ids
+
+
+dispatcher = SlackDispatcher()
+channels = ChannelDirectory(dispatcher)
@@ -0,0 +1,125 @@
+import datetime
+import timeit
+import numpy as np
+
+BLACKLISTED_SUBREDDITS = ('theredpill', 'rage', 'atheism', 'conspiracy', 'the_donald', 'subredditcancer', 'SRSsucks',
+                          'drama', 'undelete', 'blackout2015', 'oppression', 'kotakuinaction', 'tumblrinaction',
+                          'offensivespeech', 'bixnood')
+
+# (likelihood, color, troll index from, negative karma per 500 comments below, average karma below), mildest first.
+# A user gets the last tier that any of its conditions puts them in
+TROLL_TIERS = (('Low', 'good', np.inf, -np.inf, -np.inf),
+               ('Moderate', 'warning', 40, -70, 1),
+               ('High', 'danger', 60, -130, -2),
+               ('Very high', 'danger', 80, -180, -5),
+               ('Extremely high', 'danger', 100, -200, -10))
+
+
+class SummaryStats:
+
+    """The numbers behind a /user summary, computed with NumPy over the user's comments. Every per-comment sequence is
+    newest first, as Reddit lists them. limit is how many comments were asked for, and scales the thresholds when the
+    user has fewer"""
+
+    def __init__(self, created, scores, subreddits, words, short, comment_karma, limit=500):
+        self.created = np.asarray(created, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.int64)
+        self.subreddits = np.asarray(subreddits, dtype=str)
+        self.words = np.asarray(words, dtype=np.int64)
+        self.short = np.asarray(short, dtype=bool)
+        self.comment_karma = comment_karma
+        self.limit = limit
+        self.count = len(self.scores)
+
+    @classmethod
+    def from_history(cls, history, comment_karma, limit=500):
+
+        """Takes the (created_utc, score, subreddit, words, short) rows of RedditBot.get_comment_history"""
+
+        columns = list(zip(*history)) or [(), (), (), (), ()]
+
+        return cls(*columns, comment_karma=comment_karma, limit=limit)
+
+    def average_karma(self):
+        return self.scores.mean()
+
+    def total_negative_karma(self):
+        return self.scores[self.scores < 0].sum()
+
+    def troll_index(self):
+
+        blacklisted = np.isin(self.subreddits, BLACKLISTED_SUBREDDITS).sum()
+
+        return (0.1 * self.short.sum() + 2.5 * blacklisted) * self.limit / self.count
+
+    def troll_likelihood(self):
+
+        """Returns the (likelihood, color) of the highest tier the user reaches"""
+
+        tiers = np.array([tier[2:] for tier in TROLL_TIERS])
+        reached = ((self.troll_index() >= tiers[:, 0]) |
+                   (self.total_negative_karma() < tiers[:, 1] * self.count / self.limit) |
+                   (self.average_karma() < tiers[:, 2]))
+        reached[0] = True
+
+        tier = TROLL_TIERS[np.flatnonzero(reached)[-1]]
+
+        return tier[0], tier[1]
+
+    def subreddit_histogram(self):
+
+        """Returns the names and comment counts of the subreddits the user is active enough in to show in the chart,
+        in the order the user last commented in them"""
+
+        names, first_seen, counts = np.unique(self.subreddits, return_index=True, return_counts=True)
+        order = np.argsort(first_seen, kind='stable')
+        names, counts = names[order], counts[order]
+
+        threshold = self.count / (20 * (self.limit / 200)) / (len(names) / 30)
+        shown = counts > threshold
+
+        return names[shown].tolist(), counts[shown].tolist()
+
+    def marker_sizes(self):
+
+        """Scatter marker size of each comment, growing with its word count"""
+
+        return (((self.words - 50) * (2000 - 50)) / (700 - 50) + 50).tolist()
+
+    def cumulative_karma(self):
+
+        """The user's estimated total comment karma after each comment"""
+
+        karma_at_start = self.comment_karma - abs(self.average_karma() * self.count)
+
+        return (karma_at_start + np.cumsum(self.scores[::-1])[::-1]).tolist()
+
+    def dates(self):
+        return [datetime.datetime.utcfromtimestamp(created) for created in self.created.tolist()]
+
+
+def benchmark(comments=5000, runs=20):
+
+    """Times the summary statistics on a random history of the given size and returns the average seconds per run"""
+
+    rng = np.random.default_rng(0)
+    subreddit_pool = ['subreddit%s' % n for n in range(200)] + list(BLACKLISTED_SUBREDDITS)
+    history = list(zip(range(1500000000, 1500000000 - comments, -1),
+                       rng.integers(-50, 200, comments).tolist(),
+                       rng.choice(subreddit_pool, comments).tolist(),
+                       rng.integers(1, 400, comments).tolist(),
+                       rng.random(comments) < 0.3))
+
+    def run():
+        stats = SummaryStats.from_history(history, comment_karma=10000, limit=comments)
+        stats.troll_likelihood()
+        stats.subreddit_histogram()
+        stats.marker_sizes()
+        stats.cumulative_karma()
+
+    return timeit.timeit(run, number=runs) / runs
+
+
+if __name__ == '__main__':
+    for size in (500, 5000, 50000):
+        print("%s comments: %.2f ms" % (size, benchmark(size) * 1000))
@@ -1,6 +1,13 @@
 import json
-import requests
 import configparser
+import collections
+import threading
+import time
+import os
+import tempfile
+import heapq
+import reddit_interface.slack_dispatcher as slack_dispatcher
+import reddit_interface.bot_threading as bot_threading
 
 
 def get_token(token_name, config_name='tokens.ini'):
@@ -14,31 +21,144 @@ SLACK_SLASHCMDS_SECRET = get_token("SLACK_SLASHCMDS_SECRET")
 SLACK_BOT_TOKEN = get_token('SLACK_BOT_TOKEN')
 
 
-def get_sub_name(team_id, filename='config.ini'):
-    config = configparser.ConfigParser()
-    config.read(filename)
+class ConfigRegistry:
+
+    """Keeps a single parsed copy of a config file, plus an index of Slack team IDs to subreddits. The file is parsed
+    again only when its modification time changes, which is checked at most every check_interval seconds. Writes
+    replace the file atomically and are visible to every reader straight away"""
+
+    def __init__(self, filename, check_interval=5):
+        self.filename = filename
+        self.check_interval = check_interval
+        self.config = None
+        self.team_index = dict()
+        self._mtime = None
+        self._last_check = 0
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._check(force=True)
+
+    def _get_mtime(self):
+
+        try:
+            return os.stat(self.filename).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _check(self, force=False):
+
+        now = time.time()
+
+        if not force and now - self._last_check < self.check_interval:
+            return
+
+        with self._lock:
+            self._last_check = now
+            mtime = self._get_mtime()
+
+            if force or mtime != self._mtime:
+                config = configparser.ConfigParser()
+                config.read(self.filename)
+                self._mtime = mtime
+                self._set_config(config)
+
+    def _set_config(self, config):
+
+        team_index = dict()
+
+        for section in config.sections():
+            team_id = config.get(section, "slackteam_id", fallback=None)
+            if team_id is not None:
+                team_index[team_id] = section
+
+        self.config = config
+        self.team_index = team_index
+
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener):
+
+        """Calls listener() every time the configuration changes"""
+
+        self._listeners.append(listener)
+
+    def get_config(self):
+        self._check()
+        return self.config
+
+    def get_sub_name(self, team_id):
+        self._check()
+        return self.team_index.get(team_id)
 
-    for section in config.sections():
-        for key, val in config.items(section):
-            if key == "slackteam_id" and val == team_id:
-                return section
-    return None
+    def sections(self):
+        self._check()
+        return self.config.sections()
+
+    def set_option(self, section, name, value):
+
+        with self._lock:
+            config = configparser.ConfigParser()
+            config.read_dict(self.config)
+            config[section][name] = value
+
+            directory = os.path.dirname(os.path.abspath(self.filename))
+            fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".tmp")
+
+            try:
+                with os.fdopen(fd, 'w') as configfile:
+                    config.write(configfile)
+                    configfile.flush()
+                    os.fsync(configfile.fileno())
+                os.replace(temp_name, self.filename)
+            except:
+                os.remove(temp_name)
+                raise
+
+            self._mtime = self._get_mtime()
+            self._set_config(config)
+
+
+_config_registries = dict()
+_config_registries_lock = threading.Lock()
+
+
+def get_config_registry(filename='config.ini'):
+
+    with _config_registries_lock:
+        registry = _config_registries.get(filename)
+
+        if registry is None:
+            registry = ConfigRegistry(filename)
+            _config_registries[filename] = registry
+
+        return registry
+
+
+def get_sub_name(team_id, filename='config.ini'):
+    return get_config_registry(filename).get_sub_name(team_id)
 
 
 def get_config_sections(filename='config.ini'):
-    config = configparser.ConfigParser()
-    config.read(filename)
-    return config.sections()
+    return get_config_registry(filename).sections()
 
 
 class RSConfig:
 
     """Associates a section of the config.ini file with a Slack team and parses the config parameters contained there"""
 
+    # Parameters that may be missing from older config.ini files, with the value used in that case
+    optional_defaults = {"comments_interval_min": "30", "comments_interval_max": "300",
+                         "modlog_interval_min": "60", "modlog_interval_max": "900",
+                         "modmail_interval_min": "5", "modmail_interval_max": "120",
+                         "submissions_interval_min": "60", "submissions_interval_max": "600",
+                         "tlc_feed_channel": "#tlc-feed", "rs_feed_channel": "#rs_feed",
+                         "ban_requests_channel": "#ban-requests", "modmail_channel": "C208X7WR0",
+                         "track_decay_days": "0", "warning_window_days": "0", "summary_cache_ttl": "600"}
+
     def __init__(self, subreddit, filename='config.ini'):
         self.filename = filename
-        self.config = configparser.ConfigParser()
-        self.config.read(filename)
+        self.registry = get_config_registry(filename)
         self.subreddit = subreddit
         self.slackteam_id = None
         self.comment_warning_threshold = None
@@ -55,8 +175,28 @@ class RSConfig:
         self.remove_unflaired = None
         self.bot_user_token = None
         self.banlist_populated = None
+        self.comments_interval_min = None
+        self.comments_interval_max = None
+        self.modlog_interval_min = None
+        self.modlog_interval_max = None
+        self.modmail_interval_min = None
+        self.modmail_interval_max = None
+        self.submissions_interval_min = None
+        self.submissions_interval_max = None
+        self.tlc_feed_channel = None
+        self.rs_feed_channel = None
+        self.ban_requests_channel = None
+        self.modmail_channel = None
+        self.track_decay_days = None
+        self.warning_window_days = None
+        self.summary_cache_ttl = None
 
         self._update()
+        self.registry.add_listener(self._update)
+
+    @property
+    def config(self):
+        return self.registry.get_config()
 
     def _update(self):
 
@@ -75,6 +215,27 @@ class RSConfig:
         self.monitor_comments = self.config.getboolean(self.subreddit, "monitor_comments")
         self.remove_unflaired = self.config.getboolean(self.subreddit, "remove_unflaired")
         self.banlist_populated = self.config.getboolean(self.subreddit, "banlist_populated")
+        self.comments_interval_min = self._getint_optional("comments_interval_min")
+        self.comments_interval_max = self._getint_optional("comments_interval_max")
+        self.modlog_interval_min = self._getint_optional("modlog_interval_min")
+        self.modlog_interval_max = self._getint_optional("modlog_interval_max")
+        self.modmail_interval_min = self._getint_optional("modmail_interval_min")
+        self.modmail_interval_max = self._getint_optional("modmail_interval_max")
+        self.submissions_interval_min = self._getint_optional("submissions_interval_min")
+        self.submissions_interval_max = self._getint_optional("submissions_interval_max")
+        self.tlc_feed_channel = self._get_optional("tlc_feed_channel")
+        self.rs_feed_channel = self._get_optional("rs_feed_channel")
+        self.ban_requests_channel = self._get_optional("ban_requests_channel")
+        self.modmail_channel = self._get_optional("modmail_channel")
+        self.track_decay_days = self._getint_optional("track_decay_days")
+        self.warning_window_days = self._getint_optional("warning_window_days")
+        self.summary_cache_ttl = self._getint_optional("summary_cache_ttl")
+
+    def _get_optional(self, name):
+        return self.config.get(self.subreddit, name, fallback=self.optional_defaults[name])
+
+    def _getint_optional(self, name):
+        return self.config.getint(self.subreddit, name, fallback=int(self.optional_defaults[name]))
 
     def get_config(self, name):
         return self.config.get(self.subreddit, name)
@@ -84,12 +245,10 @@ class RSConfig:
         try:
             self.get_config(name)
         except configparser.NoOptionError:
-            return False
-
-        self.config[self.subreddit][name] = value
+            if name not in self.optional_defaults:
+                return False
 
-        with open(self.filename, 'w') as configfile:
-            self.config.write(configfile)
+        self.registry.set_option(self.subreddit, name, value)
         return True
 
     def list_config(self):
@@ -231,10 +390,11 @@ class SlackResponse:
 
         return self.response_dict
 
-    def post_to_channel(self, token, channel, as_user=False):
+    def post_to_channel(self, token, channel, as_user=False, wait=True):
 
         """Posts the SlackResponse object to a specific channel. The Slack team it's posted to depends on the
-        token that is passed. Passing as_user will make RS post the response as the user who authorized the app."""
+        token that is passed. Passing as_user will make RS post the response as the user who authorized the app.
+        With wait=False the message is queued on the Slack dispatcher and no timestamp is returned."""
 
         response_dict = self.get_dict()
 
@@ -243,34 +403,50 @@ class SlackResponse:
         except KeyError:
             pass
 
+        channel = slack_dispatcher.channels.resolve(token, channel)
         response_dict['channel'] = channel
         response_dict['token'] = token
 
         if as_user:
             response_dict['as_user'] = 'true'
 
-        request_response = requests.post('https://slack.com/api/chat.postMessage',
-                                         params=response_dict)
+        params = dict(response_dict)
 
         try:
             response_dict['attachments'] = json.loads(self.response_dict['attachments'])
         except KeyError:
             pass
 
-        return request_response.json().get('ts', None)
+        if not wait:
+            slack_dispatcher.dispatcher.call_async('chat.postMessage', params, channel=channel)
+            return None
 
-    def update_message(self, timestamp, channel, parse='full'):
+        reply = slack_dispatcher.dispatcher.call('chat.postMessage', params, channel=channel)
 
-        response_dict = self.get_dict()
+        if reply.get('error') == 'channel_not_found':
+            # The channel may have been renamed or recreated since the directory was loaded
+            slack_dispatcher.channels.invalidate(token)
+
+        return reply.get('ts', None)
+
+    def update_message(self, timestamp, channel, parse='full', token=None):
+
+        """Replaces the message posted at timestamp with this response and returns Slack's reply"""
+
+        if token is None:
+            token = SLACK_BOT_TOKEN
+
+        response_dict = dict(self.get_dict())
         response_dict['attachments'] = json.dumps(self.response_dict['attachments'])
-        response_dict['channel'] = channel
-        response_dict['token'] = SLACK_BOT_TOKEN
+        response_dict['channel'] = slack_dispatcher.channels.resolve(token, channel)
+        response_dict['token'] = token
         response_dict['ts'] = timestamp
         response_dict['as_user'] = 'true'
-        response_dict['parse'] = parse
 
-        request_response = requests.post('https://slack.com/api/chat.update',
-                                         params=response_dict)
+        if parse is not None:
+            response_dict['parse'] = parse
+
+        return slack_dispatcher.dispatcher.call('chat.update', response_dict, channel=response_dict['channel'])
 
 
 class SlackRequest:
@@ -294,6 +470,7 @@ class SlackRequest:
             self.user_id = self.form['user']['id']
             self.team_domain = self.form['team']['domain']
             self.team_id = self.form['team']['id']
+            self.channel_id = self.form['channel']['id']
             self.callback_id = self.form['callback_id']
             self.actions = self.form['actions']
             self.message_ts = self.form['message_ts']
@@ -305,6 +482,7 @@ class SlackRequest:
             self.command = self.form['command']
             self.text = self.form['text']
             self.channel_name = self.form['channel_name']
+            self.channel_id = self.form['channel_id']
 
         self.response_url = self.form['response_url']
         self.token = self.form['token']
@@ -323,7 +501,9 @@ class SlackRequest:
             headers = {"content-type": "application/json"}
             response = response.get_json()
 
-        slack_response = requests.post(self.response_url, data=response, headers=headers)
+        # Paced with the other messages to the same channel, so a rate limit elsewhere doesn't hold this one back
+        slack_response = slack_dispatcher.dispatcher.request(self.response_url, data=response, headers=headers,
+                                                             key=self.channel_id)
 
         return slack_response
 
@@ -342,11 +522,286 @@ def grab_attachment_args(original_message):
     return {'text': attachment_text, 'title': attachment_title, 'title_link': attachment_title_link, 'field': field}
 
 
+class SeenItems:
+
+    """Remembers which Reddit items each stream (comments, modlog, modmail...) has already handled. Lookups are served
+    from memory, new IDs are written to the subreddit's database in batches, and each stream only keeps its newest
+    max_items IDs that are younger than max_age seconds"""
+
+    def __init__(self, db, max_items=5000, max_age=30 * 86400, flush_size=100, flush_interval=60):
+        self.db = db
+        self.max_items = max_items
+        self.max_age = max_age
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._streams = dict()
+        self._pending = []
+        self._last_flush = time.time()
+        self._lock = threading.RLock()
+
+    def _get_stream(self, stream):
+
+        items = self._streams.get(stream)
+
+        if items is None:
+            items = collections.OrderedDict(self.db.fetch_seen_items(stream, self.max_items))
+            self._streams[stream] = items
+
+        return items
+
+    def _evict(self, items, now):
+
+        while len(items) > self.max_items:
+            items.popitem(last=False)
+
+        while items and next(iter(items.values())) < now - self.max_age:
+            items.popitem(last=False)
+
+    def contains(self, stream, item_id):
+
+        with self._lock:
+            return item_id in self._get_stream(stream)
+
+    def add(self, stream, *item_ids):
+
+        """Marks one or more IDs as handled by the stream. None values are ignored"""
+
+        now = int(time.time())
+
+        with self._lock:
+            items = self._get_stream(stream)
+
+            for item_id in item_ids:
+                if item_id is None:
+                    continue
+
+                items.pop(item_id, None)
+                items[item_id] = now
+                self._pending.append((stream, item_id, now))
+
+            self._evict(items, now)
+
+            if len(self._pending) >= self.flush_size or now - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+
+        """Writes pending IDs to the database and drops the rows that have been evicted from memory"""
+
+        with self._lock:
+            self._last_flush = time.time()
+
+            if not self._pending:
+                return
+
+            pending = self._pending
+            self._pending = []
+            prune_before = dict()
+
+            for stream in set(row[0] for row in pending):
+                items = self._streams[stream]
+                if items:
+                    prune_before[stream] = next(iter(items.values()))
+
+            self.db.log_seen_items(pending, prune_before)
+
+    def import_legacy_file(self, filename, streams):
+
+        """Seeds the given streams from the old comma-separated already_done.txt file, so that items handled before
+        the upgrade are not reported again. Only done when the database has no seen items yet"""
+
+        if self.db.count_seen_items():
+            return
+
+        try:
+            with open(filename, "r") as text_file:
+                legacy_ids = [item_id for item_id in text_file.read().split(",") if item_id]
+        except FileNotFoundError:
+            return
+
+        for stream in streams:
+            self.add(stream, *legacy_ids[-self.max_items:])
+
+        self.flush()
+
+
 class UnflairedSubmission:
 
     def __init__(self, submission, comment):
         self.submission = submission
         self.comment = comment
+        self.checks = 0
+        self.next_check = None
+
+
+class UnflairedQueue:
+
+    """Submissions removed for missing flair, ordered by when their flair should next be checked. Checks start
+    min_interval seconds apart and back off towards max_interval, since most users add a flair within minutes"""
+
+    def __init__(self, min_interval=30, max_interval=600):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pending = dict()
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _push(self, unflaired_submission, when):
+
+        unflaired_submission.next_check = when
+        self._counter += 1
+        heapq.heappush(self._heap, (when, self._counter, unflaired_submission))
+
+    def add(self, unflaired_submission):
+
+        with self._lock:
+            self.pending[unflaired_submission.submission.fullname] = unflaired_submission
+            self._push(unflaired_submission, time.time() + self.min_interval)
+
+    def get(self, fullname):
+
+        with self._lock:
+            return self.pending.get(fullname)
+
+    def remove(self, fullname):
+
+        """Stops tracking a submission. Returns it, or None if it wasn't pending anymore"""
+
+        with self._lock:
+            return self.pending.pop(fullname, None)
+
+    def pop_due(self):
+
+        """Returns the pending submissions whose check is due. They stay pending until removed or rescheduled"""
+
+        now = time.time()
+        due = []
+
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, counter, unflaired_submission = heapq.heappop(self._heap)
+
+                # Skip entries left behind by remove() or a later reschedule()
+                if unflaired_submission.next_check == when and \
+                        self.pending.get(unflaired_submission.submission.fullname) is unflaired_submission:
+                    due.append(unflaired_submission)
+
+        return due
+
+    def reschedule(self, unflaired_submission):
+
+        with self._lock:
+            if self.pending.get(unflaired_submission.submission.fullname) is unflaired_submission:
+                unflaired_submission.checks += 1
+                delay = min(self.min_interval * 2 ** unflaired_submission.checks, self.max_interval)
+                self._push(unflaired_submission, time.time() + delay)
+
+
+class SummaryCache:
+
+    """Finished /user summaries by username, so mods looking at the same user share one summary for ttl seconds.
+    A full summary also answers quick requests, which are its first attachment. invalidate() drops a user's summaries,
+    and a summary started before the user was invalidated is never stored"""
+
+    def __init__(self, ttl=600, max_items=200):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.hits = 0
+        self._summaries = collections.OrderedDict()
+        self._invalidated = dict()
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def get(self, username, quick=False):
+
+        """Returns a copy of the cached attachments of a user's summary, or None if there's no fresh one"""
+
+        key = username.lower()
+
+        with self._lock:
+            cached = self._summaries.get(key)
+
+            if cached is None:
+                return None
+
+            created, attachments, full = cached
+
+            if time.time() - created > self.ttl:
+                del self._summaries[key]
+                return None
+
+            if not quick and not full:
+                return None
+
+            self._summaries.move_to_end(key)
+            self.hits += 1
+
+        return list(attachments[:1] if quick else attachments)
+
+    def put(self, username, attachments, full, started):
+
+        """Stores the attachments of a summary whose computation began at the time started"""
+
+        key = username.lower()
+
+        with self._lock:
+            if max(self._invalidated.get(key, 0), self._cleared) >= started:
+                return
+
+            cached = self._summaries.get(key)
+
+            # Don't let a quick summary replace a full one of the same age
+            if cached is not None and cached[2] and not full and cached[0] >= started:
+                return
+
+            self._summaries[key] = (started, list(attachments), full)
+            self._summaries.move_to_end(key)
+
+            while len(self._summaries) > self.max_items:
+                self._summaries.popitem(last=False)
+
+    def invalidate(self, username):
+
+        key = username.lower()
+
+        with self._lock:
+            self._summaries.pop(key, None)
+            self._invalidated[key] = time.time()
+
+            # Only summaries still being computed can be older than an invalidation, and none runs for a whole ttl
+            expired = time.time() - self.ttl
+            for name in [name for name, when in self._invalidated.items() if when < expired]:
+                del self._invalidated[name]
+
+    def clear(self):
+
+        """Drops every summary, for changes that touch all users at once"""
+
+        with self._lock:
+            self._summaries.clear()
+            self._invalidated.clear()
+            self._cleared = time.time()
+
+
+def get_things(r, fullnames, chunk_size=100):
+
+    """Fetches Reddit things by fullname using one /api/info request per chunk_size of them. Returns a dict of
+    fullname to thing, leaving out the things that no longer exist"""
+
+    fullnames = list(fullnames)
+    things = dict()
+
+    for start in range(0, len(fullnames), chunk_size):
+        r._use_oauth = False
+        for thing in r.get_info(thing_id=fullnames[start:start + chunk_size]):
+            if thing is not None:
+                things[thing.fullname] = thing
+
+    return things
 
 
 def generate_flair_comment(s1, s2, s3):
@@ -375,27 +830,88 @@ Please [contact the moderators](%s) if you have any questions or concerns*
 
 class SlackModmail:
 
-    def __init__(self, root_mail, bot_token, channel):
+    """Mirrors a modmail thread in a Slack message that is edited in place with chat.update. Replies added within
+    coalesce_window seconds of each other are sent in a single update, and once a message holds page_size replies the
+    thread continues in a new message, so payloads stay small however long the thread gets. If a database is passed,
+    the Slack message and reply counts are saved after every post so the thread can be resumed after a restart"""
+
+    # Errors after which the Slack message is gone, and the page has to be posted again as a new message
+    repost_errors = ('message_not_found', 'channel_not_found')
+
+    def __init__(self, root_mail, bot_token, channel, page_size=15, coalesce_window=3, db=None, retry_delay=30,
+                 max_retries=5):
 
-        self.channel = channel
+        self.channel = slack_dispatcher.channels.resolve(bot_token, channel)
         self.current_color = 'good'
         self.message_timestamp = None
         self.bot_token = bot_token
         self.root_mail = root_mail
-        self.root_mail_message = SlackResponse("------------------")
+        self.page_size = page_size
+        self.coalesce_window = coalesce_window
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.db = db
+        self.page = 1
+        self.page_replies = 0
+        self.n_replies = 0
+        self._dirty = True
+        self._flush_scheduled = False
+        self._failed_flushes = 0
+        self._lock = threading.RLock()
+        self.root_mail_message = self._new_page_message()
 
-        self.root_mail_message.add_attachment(title=root_mail.subject,
-                                              title_link="https://www.reddit.com/message/messages/" + root_mail.id,
-                                              text=root_mail.body, color=self.current_color,
-                                              author_name="/u/" + root_mail.author.name, ts=root_mail.created_utc)
+    @classmethod
+    def resume(cls, root_mail, bot_token, state, db=None):
 
-        self.root_mail_message.attachments[0].add_button("Summary", "summary", style='primary')
-        self.root_mail_message.attachments[0].add_button("Mark done", "done")
-        self.root_mail_message.attachments[0].add_button("Mark important", "important")
-        self.root_mail_message.attachments[0].add_button("Mute", "mute", style='danger')
+        """Rebuilds a thread from the state saved by a previous post(). The replies on the current page are taken
+        from root_mail, which must be the freshly fetched modmail with all its replies"""
 
-        self.n_replies = 0
-        self.post()
+        channel, message_ts, page, page_replies, reply_count = state
+
+        modmail = cls(root_mail, bot_token, channel, db=db)
+        replies = list(root_mail.replies)[:reply_count]
+        page_start = len(replies) - min(page_replies, len(replies))
+
+        # Colors alternate with every reply, starting from 'good' on the root message
+        if page_start % 2:
+            modmail.current_color = 'danger'
+
+        modmail.page = page
+        modmail.root_mail_message = modmail._new_page_message()
+        modmail.n_replies = page_start
+
+        for reply in replies[page_start:]:
+            modmail.root_mail_message.add_attachment(text=reply.body, color=modmail.get_current_color(),
+                                                     footer="/u/" + reply.author.name, ts=reply.created_utc)
+            modmail.page_replies += 1
+            modmail.n_replies += 1
+
+        modmail.message_timestamp = message_ts
+        modmail._dirty = False
+
+        return modmail
+
+    def _new_page_message(self):
+
+        root_mail = self.root_mail
+        title_link = "https://www.reddit.com/message/messages/" + root_mail.id
+
+        if self.page == 1:
+            message = SlackResponse("------------------")
+            message.add_attachment(title=root_mail.subject, title_link=title_link, text=root_mail.body,
+                                   color=self.current_color, author_name="/u/" + root_mail.author.name,
+                                   ts=root_mail.created_utc)
+
+            message.attachments[0].add_button("Summary", "summary", style='primary')
+            message.attachments[0].add_button("Mark done", "done")
+            message.attachments[0].add_button("Mark important", "important")
+            message.attachments[0].add_button("Mute", "mute", style='danger')
+        else:
+            message = SlackResponse("------------------ (continued, page %s)" % self.page)
+            message.add_attachment(title=root_mail.subject, title_link=title_link, color=self.current_color,
+                                   author_name="/u/" + root_mail.author.name, ts=root_mail.created_utc)
+
+        return message
 
     def get_current_color(self):
 
@@ -408,21 +924,80 @@ class SlackModmail:
 
     def add_reply(self, reply):
 
-        self.root_mail_message.add_attachment(text=reply.body, color=self.get_current_color(),
-                                              footer="/u/" + reply.author.name, ts=reply.created_utc)
-        self.n_replies += 1
+        with self._lock:
+            # The current page is full: send what it's still missing and start a new message. If Slack doesn't have
+            # it yet, the page grows past page_size rather than losing its last replies
+            if self.page_replies >= self.page_size and self.post():
+                self.page += 1
+                self.page_replies = 0
+                self.message_timestamp = None
+                self.root_mail_message = self._new_page_message()
 
-        print(str(self.root_mail_message.attachments))
+            self.root_mail_message.add_attachment(text=reply.body, color=self.get_current_color(),
+                                                  footer="/u/" + reply.author.name, ts=reply.created_utc)
+            self.page_replies += 1
+            self.n_replies += 1
+            self._dirty = True
+            self._failed_flushes = 0
+            self._schedule_flush(self.coalesce_window)
 
-        self.post()
+    def _schedule_flush(self, delay):
 
-    def post(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            bot_threading.scheduler.call_later(delay, self.post, "modmail %s update" % self.root_mail.id)
+
+    def _send(self):
+
+        """Posts the current page if it hasn't been posted yet and edits it otherwise. Returns whether it worked"""
 
         if self.message_timestamp is not None:
-            delete_request_params = dict()
-            delete_request_params['token'] = self.bot_token
-            delete_request_params['channel'] = self.channel
-            delete_request_params['ts'] = self.message_timestamp
-            requests.post("https://slack.com/api/chat.delete", params=delete_request_params)
+            reply = self.root_mail_message.update_message(self.message_timestamp, self.channel, parse=None,
+                                                          token=self.bot_token)
+
+            if reply.get('ok'):
+                return True
+
+            print("Could not update modmail message: %s" % reply.get('error', 'no response'))
+
+            if reply.get('error') not in self.repost_errors:
+                return False
+
+            self.message_timestamp = None
 
         self.message_timestamp = self.root_mail_message.post_to_channel(self.bot_token, self.channel)
+
+        return self.message_timestamp is not None
+
+    def post(self):
+
+        """Sends pending changes to Slack. A failed send is retried every retry_delay seconds, up to max_retries
+        times, and again with the next reply after that. Returns whether Slack is up to date"""
+
+        with self._lock:
+            self._flush_scheduled = False
+
+            if not self._dirty:
+                return True
+
+            sent = False
+
+            try:
+                sent = self._send()
+            finally:
+                if not sent:
+                    self._failed_flushes += 1
+                    if self._failed_flushes <= self.max_retries:
+                        self._schedule_flush(self.retry_delay)
+
+            if not sent:
+                return False
+
+            self._dirty = False
+            self._failed_flushes = 0
+
+            if self.db is not None and self.message_timestamp is not None:
+                self.db.save_modmail_thread(self.root_mail.id, self.channel, self.message_timestamp, self.page,
+                                            self.page_replies, self.n_replies)
+
+            return True
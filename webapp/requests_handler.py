@@ -1,7 +1,8 @@
 import reddit_interface.bot as bot
 import reddit_interface.utils as utils
 import reddit_interface.database as db
-from puni import Note
+import reddit_interface.bot_threading as bot_threading
+import reddit_interface.slack_dispatcher as slack_dispatcher
 import os
 import sys
 from time import sleep
@@ -70,7 +71,7 @@ class RequestsHandler:
             if len(args) == 1:
                 target_user = args[0]
                 self.bots[sub].shadowban(username=target_user, author=author, request=request)
-                self.bots[sub].db.update_user_status(target_user, "shadowban")
+                self.bots[sub].update_user_status(target_user, "shadowban")
             else:
                 response = utils.SlackResponse(text="Usage: /shadowban [user]")
 
@@ -91,7 +92,7 @@ class RequestsHandler:
 
             if len(args) == 1:
                 user = args[0]
-                self.bots[sub].db.update_user_status(user, "track")
+                self.bots[sub].update_user_status(user, "track")
                 response = utils.SlackResponse(text="Tracking user.")
             else:
                 response = utils.SlackResponse(text="Usage: /track [user]")
@@ -150,11 +151,30 @@ class RequestsHandler:
                     response.add_attachment(text="Rebooting...", color='good')
                     response.post_to_channel(token=self.configs[sub].bot_user_token, channel=request.channel_name)
 
+                    # exec skips atexit handlers, so write out the buffered audit logs first
+                    for database in self.databases.values():
+                        database.audit_log.flush(10)
+
                     os.execl(sys.executable, sys.executable, *sys.argv)
                 elif args[0] == "list":
                     config_str = self.configs[sub].list_config()
                     response = utils.SlackResponse(text="Showing configuration for RedditSlacker")
                     response.add_attachment(text=config_str, color='good')
+                elif args[0] == "jobs":
+                    response = utils.SlackResponse(text="Showing RedditSlacker jobs")
+                    response.add_attachment(text=bot_threading.action_pool.status(), color='good')
+                    response.add_attachment(text=bot_threading.poller_pool.status(), color='good')
+                    response.add_attachment(text=bot_threading.scheduler.status(prefix=sub + " "), color='good')
+                    response.add_attachment(text=slack_dispatcher.dispatcher.status(), color='good')
+                elif args[0] == "dbcheck":
+                    database = self.databases[sub]
+                    problems = database.check_query_plans()
+                    response = utils.SlackResponse(text="Database schema version %s" % database.get_schema_version())
+
+                    if problems:
+                        response.add_attachment(text="\n".join(problems), color='danger')
+                    else:
+                        response.add_attachment(text="Every hot query uses an index.", color='good')
 
                 else:
                     response = utils.SlackResponse()
@@ -178,30 +198,28 @@ class RequestsHandler:
             response = utils.SlackResponse(text="Updated user status.")
 
             if button_pressed == "permamute":
-                n = Note(arg, "Permamuted via RedditSlacker by Slack user '%s'" % author,
-                              arg, '', 'botban')
+                note = "Permamuted via RedditSlacker by Slack user '%s'" % author
             else:
-                n = Note(arg, "Unpermamuted via RedditSlacker by Slack user '%s'" % author,
-                         arg, '', 'botban')
-            self.bots[sub].un.add_note(n)
+                note = "Unpermamuted via RedditSlacker by Slack user '%s'" % author
+            self.bots[sub].add_note(username=arg, note=note, note_type='botban')
 
-            self.bots[sub].db.update_user_status(arg, status_type)
+            self.bots[sub].update_user_status(arg, status_type)
 
         elif button_pressed == "track":
             response = utils.SlackResponse(text="Tracking user.")
-            self.bots[sub].db.update_user_status(arg, status_type)
+            self.bots[sub].update_user_status(arg, status_type)
 
         elif button_pressed == "untrack":
             response = utils.SlackResponse(text="Ceasing to track user.")
-            self.bots[sub].db.update_user_status(arg, status_type)
+            self.bots[sub].update_user_status(arg, status_type)
 
         elif button_pressed == "shadowban":
             self.bots[sub].shadowban(username=arg, author=author, request=request)
-            self.bots[sub].db.update_user_status(arg, status_type)
+            self.bots[sub].update_user_status(arg, status_type)
 
         elif button_pressed == "unshadowban":
             self.bots[sub].unshadowban(username=arg, author=author, request=request)
-            self.bots[sub].db.update_user_status(arg, status_type)
+            self.bots[sub].update_user_status(arg, status_type)
 
         elif button_pressed == "verify":
             attachment_args = utils.grab_attachment_args(request.original_message)
@@ -221,7 +239,8 @@ class RequestsHandler:
                                               value=attachment_args['field']['value'])
             response.attachments[0].add_button("Verify", value="verify", style='primary')
             response.attachments[0].add_button("Track user", value="track_" + attachment_args['field']['value'])
-            response.post_to_channel(token=self.configs[sub].bot_user_token, channel='#ban-requests')
+            response.post_to_channel(token=self.configs[sub].bot_user_token,
+                                     channel=self.configs[sub].ban_requests_channel, wait=False)
 
             self.bots[sub].report_comment(cmt_id=arg, reason="Slack user @%s has requested a ban." % author)
 
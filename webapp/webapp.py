@@ -1,8 +1,10 @@
 import os
+import threading
 import requests
 from flask import Flask, request, Response
 from flask_sslify import SSLify
 import reddit_interface.utils as utils
+import reddit_interface.bot_threading as bot_threading
 from webapp.requests_handler import RequestsHandler
 
 APP_SECRET_KEY = utils.get_token("FLASK_APP_SECRET_KEY")
@@ -16,6 +18,43 @@ sslify = SSLify(app)
 app.secret_key = APP_SECRET_KEY
 handler = RequestsHandler()
 
+# Slack gives up on a request after 3 seconds, so we answer after at most ACK_DEADLINE whatever the handler is doing
+ACK_DEADLINE = 2.0
+request_pool = bot_threading.WorkerPool("slack requests", workers=16, max_queue=128, job_timeout=60)
+
+
+def respond_in_time(slack_request, method, *args, **kwargs):
+
+    """Runs a RequestsHandler method on the request pool and waits up to ACK_DEADLINE for its response. If it takes
+    longer, returns None so the caller can acknowledge the request right away, and the handler's response is sent to
+    the request's response_url once it's ready"""
+
+    lock = threading.Lock()
+    responses = []
+    acknowledged = []
+
+    def run(req):
+        response = method(req, *args, **kwargs)
+
+        with lock:
+            responses.append(response)
+            if acknowledged and response is not None:
+                req.delayed_response(response)
+
+    job = request_pool.submit(slack_request, run, name=method.__name__, retry=False)
+
+    if job is None:
+        return utils.SlackResponse(text="RedditSlacker is busy right now, please try again in a minute.")
+
+    job.wait(ACK_DEADLINE)
+
+    with lock:
+        if responses:
+            return responses[0]
+
+        acknowledged.append(True)
+        return None
+
 
 @app.route("/oauthcallback")
 def oauth_callback():
@@ -30,7 +69,10 @@ def command():
     slack_request = utils.SlackRequest(request)
     if slack_request.is_valid:
 
-        response = handler.command_response(slack_request, form=request.form)
+        response = respond_in_time(slack_request, handler.command_response, form=request.form)
+
+        if response is None:
+            response = utils.SlackResponse(text="Processing your request... please allow a few seconds.")
 
         return Response(response=response.get_json(), mimetype="application/json")
 
@@ -44,7 +86,7 @@ def button_response():
     slack_request = utils.SlackRequest(request)
     if slack_request.is_valid:
 
-        response = handler.button_response(slack_request)
+        response = respond_in_time(slack_request, handler.button_response)
 
         if response is None:
             return Response(status=200)